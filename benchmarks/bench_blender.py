@@ -0,0 +1,82 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import/export benchmarks, run inside a headless Blender:
+#   blender -b --factory-startup --python benchmarks/bench_blender.py -- --out results.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import bpy
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root)
+sys.path.append(os.path.join(root, 'io_gfbmdl'))
+
+import io_gfbmdl
+import synth_model
+
+# The operator lives under bpy.ops.import, which is a python keyword
+def ImportOp(**kwargs):
+    return getattr(bpy.ops, "import").gfmdl(**kwargs)
+
+def ClearScene():
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+
+def Timeit(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def BenchImportExport(tmp, vertices, files):
+    paths = []
+    for i in range(files):
+        paths.append(synth_model.WriteModel(os.path.join(tmp, "bench_%d_%d.gfbmdl" % (vertices, i)), vertices=vertices, seed=i))
+
+    ClearScene()
+    importTime = Timeit(lambda: ImportOp(directory=tmp + os.sep, files=[{"name": os.path.basename(p)} for p in paths]))
+
+    # Export a single model so the scene holds one armature
+    ClearScene()
+    ImportOp(directory=tmp + os.sep, files=[{"name": os.path.basename(paths[0])}])
+    out = os.path.join(tmp, "export_%d.gfbmdl" % vertices)
+    exportTime = Timeit(lambda: bpy.ops.export.gfmdl(filepath=out))
+    return [
+        {"name": "blender_import", "params": {"vertices": vertices, "files": files}, "seconds": importTime},
+        {"name": "blender_export", "params": {"vertices": vertices}, "seconds": exportTime, "bytes": os.path.getsize(out)},
+    ]
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description="Time gfbmdl import and export inside Blender.")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 60000])
+    parser.add_argument("--files", type=int, default=4, help="models per batch import")
+    args = parser.parse_args(argv)
+
+    io_gfbmdl.register()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            results.extend(BenchImportExport(tmp, size, args.files))
+
+    for r in results:
+        print("%-16s %-40s %10.3f ms" % (r["name"], json.dumps(r["params"]), r["seconds"] * 1000.0))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({"blender": bpy.app.version_string, "results": results}, f, indent=2)
+
+main()
@@ -0,0 +1,198 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Pure python benchmarks, no Blender needed:
+#   python benchmarks/bench_gfbmdl.py --out results.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_gfbmdl'))
+
+import Gfbmdl.Model
+import model_tables
+from vertex_buffer import EncodeVertexBuffer, DecodeVertexBuffer, FieldName
+from Gfbmdl.VertexType import VertexType
+from Gfbmdl.BufferFormat import BufferFormat
+from material_view import MaterialCache
+from model_data import DecodeModelFile
+from model_builder import ModelBuilder
+from model_writer import MeshDesc, CreateMesh, BuildModel
+from model_encoder import EncodeModel
+import synth_model
+
+# #####################################################
+# Utils
+# #####################################################
+def Timeit(fn, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": float(numpy.median(times)), "repeat": repeat}
+
+def Result(name, params, timing, **extra):
+    res = {"name": name, "params": params, "seconds": timing}
+    res.update(extra)
+    return res
+
+# Largest round trip error each format should show: half a step for the
+# fixed point formats (biased byte normals step 2/255), half an ulp relative
+# to the largest value for the float formats
+FormatPrecision = {
+    BufferFormat.Float: 2.0 ** -24,
+    BufferFormat.HalfFloat: 2.0 ** -11,
+    BufferFormat.Byte: 1.0 / 255.0,
+    BufferFormat.Short: 1.0 / 32767.0,
+    BufferFormat.BytesAsFloat: 1.0 / 255.0,
+}
+
+def ExpectedError(vtype, format, values):
+    if vtype == VertexType.BoneID:
+        return 0.0
+    prec = FormatPrecision[format]
+    if format in (BufferFormat.Float, BufferFormat.HalfFloat):
+        prec *= max(float(numpy.abs(values).max()), 1.0)
+    return prec * 1.001 + 1e-6
+
+def ScanMatValue(mat, param):
+    for v in range(mat.ValuesLength()):
+        if mat.Values(v).Name().decode('utf-8') == param:
+            return mat.Values(v).Value()
+    return None
+
+# #####################################################
+# Benchmarks
+# #####################################################
+def BenchDecode(tmp, vertices, repeat):
+    path = synth_model.WriteModel(os.path.join(tmp, "decode_%d.gfbmdl" % vertices), vertices=vertices)
+    timing = Timeit(lambda: DecodeModelFile(path), repeat)
+    return Result("decode", {"vertices": vertices}, timing, vertices_per_second=vertices / timing["min"])
+
+def BenchEncode(vertices, repeat):
+    rng = numpy.random.default_rng(0)
+    layout = synth_model.DefaultLayout
+    attribs = synth_model.RandomAttributes(rng, layout, vertices, 64)
+    faces = [(0, synth_model.RandomFaces(rng, vertices, vertices))]
+    def encode():
+        builder = ModelBuilder(0)
+        mesh = MeshDesc(layout, EncodeVertexBuffer(attribs, layout, vertices).view(numpy.uint8), faces)
+        builder.Finish(CreateMesh(builder, mesh))
+        return builder.Output()
+    timing = Timeit(encode, repeat)
+    return Result("encode", {"vertices": vertices}, timing, vertices_per_second=vertices / timing["min"])
+
+# Whole model through flatbuffers.Builder and through the direct encoder
+def BenchModelEncode(vertices, bones, materials, repeat):
+    desc = synth_model.RandomModel(vertices=vertices, bones=bones, materials=materials)
+    if bytes(BuildModel(desc)) != bytes(EncodeModel(desc)):
+        raise RuntimeError("direct encoder output differs from flatbuffers.Builder")
+    res = {"vertices": vertices, "bones": bones, "materials": materials}
+    builder = Timeit(lambda: BuildModel(desc), repeat)
+    direct = Timeit(lambda: EncodeModel(desc), repeat)
+    return [Result("encode_model_builder", res, builder), Result("encode_model_direct", res, direct, speedup=builder["min"] / direct["min"])]
+
+# Bone, group and material walk through the generated classes and model_tables
+def BenchAccessors(bones, materials, params, repeat):
+    buf = synth_model.BuildModel(vertices=3, bones=bones, materials=materials, params=params)
+    def walk(mon):
+        for i in range(mon.BonesLength()):
+            bone = mon.Bones(i)
+            bone.Name()
+            bone.Parent()
+            for vec in (bone.Translation(), bone.Rotation(), bone.Scale()):
+                if vec is not None:
+                    (vec.X(), vec.Y(), vec.Z())
+        for i in range(mon.GroupsLength()):
+            bb = mon.Groups(i).Bounding()
+            (bb.MinX(), bb.MinY(), bb.MinZ(), bb.MaxX(), bb.MaxY(), bb.MaxZ())
+        for i in range(mon.MaterialsLength()):
+            mat = mon.Materials(i)
+            for v in range(mat.ValuesLength()):
+                value = mat.Values(v)
+                (value.Name(), value.Value())
+            for c in range(mat.ColorsLength()):
+                col = mat.Colors(c).Color()
+                (col.R(), col.G(), col.B())
+    res = {"bones": bones, "materials": materials, "params": params}
+    generated = Timeit(lambda: walk(Gfbmdl.Model.Model.GetRootAsModel(buf, 0)), repeat)
+    tables = Timeit(lambda: walk(model_tables.Model.GetRootAsModel(buf, 0)), repeat)
+    return [Result("accessors_generated", res, generated), Result("accessors_tables", res, tables, speedup=generated["min"] / tables["min"])]
+
+def BenchMaterialLookup(materials, params, repeat):
+    buf = synth_model.BuildModel(vertices=3, materials=materials, params=params)
+    mon = Gfbmdl.Model.Model.GetRootAsModel(buf, 0)
+    names = ["Value%d" % i for i in range(2, params)]
+    def scan():
+        for m in range(materials):
+            mat = mon.Materials(m)
+            for n in names:
+                ScanMatValue(mat, n)
+    def indexed():
+        cache = MaterialCache(mon)
+        for m in range(materials):
+            mat = cache.Get(m)
+            for n in names:
+                mat.Value(n)
+    res = {"materials": materials, "params": params}
+    return [Result("material_lookup_scan", res, Timeit(scan, repeat)), Result("material_lookup_view", res, Timeit(indexed, repeat))]
+
+def BenchRoundTrip(vertices, repeat):
+    results = []
+    rng = numpy.random.default_rng(0)
+    for format, layout in zip(synth_model.BufferFormats, synth_model.AllLayouts()):
+        attribs = synth_model.RandomAttributes(rng, layout, vertices, 64)
+        def roundtrip():
+            return DecodeVertexBuffer(EncodeVertexBuffer(attribs, layout, vertices).view(numpy.uint8), layout)
+        decoded = roundtrip()
+        errors = {}
+        for vtype, values in attribs.items():
+            err = float(numpy.abs(decoded[vtype].astype(numpy.float64) - values).max())
+            if err > ExpectedError(vtype, format, values):
+                raise RuntimeError("%s round trip error %g in format %d exceeds its precision" % (FieldName(vtype), err, format))
+            errors[FieldName(vtype)] = err
+        results.append(Result("roundtrip", {"vertices": vertices, "format": format}, Timeit(roundtrip, repeat), max_error=errors))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time gfbmdl decode, encode, model encode, accessors, material lookup and round trip.")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 60000])
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            results.append(BenchDecode(tmp, size, args.repeat))
+            results.append(BenchEncode(size, args.repeat))
+    results.extend(BenchModelEncode(args.sizes[0], 120, 30, args.repeat))
+    results.extend(BenchAccessors(500, 30, 150, args.repeat))
+    results.extend(BenchMaterialLookup(30, 150, args.repeat))
+    results.extend(BenchRoundTrip(args.sizes[-1], args.repeat))
+
+    for r in results:
+        print("%-22s %-40s %10.3f ms" % (r["name"], json.dumps(r["params"]), r["seconds"]["min"] * 1000.0))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({"python": sys.version.split()[0], "numpy": numpy.__version__, "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
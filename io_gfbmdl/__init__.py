@@ -43,6 +43,22 @@ class ImportGfmdl( bpy.types.Operator ):
             )
     files : bpy.props.CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
     directory : bpy.props.StringProperty(subtype='FILE_PATH', options={'HIDDEN', 'SKIP_SAVE'})
+    jobs : IntProperty(
+            name = "Jobs",
+            description = "Number of processes decoding files in parallel (0 uses every core)",
+            default = 0,
+            min = 0,
+            )
+    profile : BoolProperty(
+            name = "Profile",
+            description = "Time each phase and write a .profile.json report next to the file",
+            default = False,
+            )
+    profile_cprofile : BoolProperty(
+            name = "cProfile",
+            description = "Also dump cProfile stats to a .prof file (needs Profile)",
+            default = False,
+            )
     
     def invoke(self, context, event):
         if not self.filepath:
@@ -60,6 +76,30 @@ class ExportGfmdl( bpy.types.Operator ):
     bl_label = "Export GFMDL"
     
     filepath: StringProperty(subtype='FILE_PATH')
+    optimize : BoolProperty(
+            name = "Optimize for GPU",
+            description = "Reorder triangles and vertices for the vertex cache, overdraw and vertex fetch",
+            default = False,
+            )
+    quantization : EnumProperty(
+            name = "Quantization",
+            description = "Vertex attribute formats to write",
+            items = (
+                ('FULL', "Full", "Float positions and UVs"),
+                ('COMPACT', "Compact", "Smaller position and UV formats where the error stays within tolerance"),
+                ),
+            default = 'FULL',
+            )
+    profile : BoolProperty(
+            name = "Profile",
+            description = "Time each phase and write a .profile.json report next to the file",
+            default = False,
+            )
+    profile_cprofile : BoolProperty(
+            name = "cProfile",
+            description = "Also dump cProfile stats to a .prof file (needs Profile)",
+            default = False,
+            )
     
     def invoke(self, context, event):            
         if not self.filepath:
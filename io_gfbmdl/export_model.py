@@ -47,12 +47,16 @@ import Gfbmdl.TextureMap
 import Gfbmdl.TextureMapping
 import Gfbmdl.CollisionGroup
 import Gfbmdl.Vector3
-
-# Globals
-use_binormals = True
-has_UVs = [ True, False, False, False ]
-has_Colors = [ True, True, False, False ]
-has_bones = True
+import numpy
+from vertex_buffer import BuildVertexDtype, EncodeVertexBuffer, DecodeVertexBuffer, WeldVertices, MeasureError, ChooseFormat
+from mesh_split import SplitTriangles, MeshChunk
+from mesh_optimize import CacheStats, OptimizeVertexCache, OptimizeOverdraw, OptimizeVertexFetch
+from model_writer import ModelDesc, MaterialDesc, MeshDesc
+from model_encoder import EncodeModel
+from skeleton import BoneIndexMap, SolveLocalMatrices, DecomposeMatrices
+from shader_presets import GetPreset, DEFAULT_SHADER
+from skinning import InfluenceTable, GatherInfluences, MapGroupsToBones, SelectInfluences, BoneIdType
+import profiling
 
 # enums
 class VertexType(IntEnum):
@@ -82,157 +86,6 @@ class WrapMode(IntEnum):
     Clamp = 1
     Mirror = 2
 
-# Temporary i guess
-matSwitches = [
-    ("useColorTex", 1),
-    ("SwitchEmissionMaskTexUV", 0),
-    ("EmissionMaskUse", 0),
-    ("SwitchPriority", 0),
-    ("Layer1Enable", 0),
-    ("SwitchAmbientTexUV", 0),
-    ("AmbientMapEnable", 1),
-    ("SwitchNormalMapUV", 0),
-    ("NormalMapEnable", 1),
-    ("LightTableEnable", 1),
-    ("SpecularMaskEnable", 0),
-    ("BaseColorAddEnable", 1),
-    ("SphereMapEnable", 0),
-    ("SphereMaskEnable", 0),
-    ("RimMaskEnable", 0),
-    ("alphaShell", 0),
-    ("EffectVal", 1),
-    ("NormalEdgeEnable", 1),
-    ("OutLineIDEnable", 0),
-    ("OutLineColFixed", 0)
-]
-
-matValues = [
-    ("ColorUVScaleU", 2.0),
-    ("ColorUVScaleV", 1.0),
-    ("ColorUVTranslateU", 0.0),
-    ("ColorBaseU", 0.0),
-    ("ColorUVTranslateV", 0.0),
-    ("ColorBaseV", 0.0),
-    ("ConstantColor0Val", 1.0),
-    ("Layer1UVScaleU", 1.0),
-    ("Layer1UVScaleV", 1.0),
-    ("Layer1UVTranslateU", 0.0),
-    ("Layer1BaseU", 0.0),
-    ("Layer1UVTranslateV", 0.0),
-    ("Layer1BaseV", 0.0),
-    ("EmissionMaskVal", 1.0),
-    ("ConstantColorSd0Val", 1.0),
-    ("ConstantColor1Val", 1.0),
-    ("ConstantColorSd1Val", 1.0),
-    ("ColorLerpValue", 0.0),
-    ("L1ConstantColor0Val", 1.0),
-    ("L1AddColor0Val", 0.0),
-    ("L1ConstantColor1Val", 1.0),
-    ("L1AddColor1Val", 0.0),
-    ("L1ConstantColorSd0Val", 1.0),
-    ("L1ConstantColorSd1Val", 1.0),
-    ("Layer1OverLerpValue", 1.0),
-    ("NormalMapUVScaleU", 1.0),
-    ("NormalMapUVScaleV", 1.0),
-    ("LightTblIndex", 6.0),
-    ("LightMul", 1.0),
-    ("SpecularPower", 6.0),
-    ("SpecularScale", 0.3),
-    ("SphereMapColorVal", 1.0),
-    ("RimColorVal", 1.0),
-    ("RimPower", 8.0),
-    ("RimStrength", 8.0),
-    ("OnGameEmissionVal", 1.0),
-    ("ConstantColorVal", 1.0),
-    ("ConstantAlpha", 1.0),
-    ("OnGameColorVal", 1.0),
-    ("OnGameAlpha", 1.0),
-    ("OutLineID", 0.0),
-    ("ProgID", 0.0),
-    ("Def0_OneMin1_FreCol", 1.0),
-    ("DistortionIntensity", 1.0),
-    ("Sin01", 4.0),
-    ("ScaleUV", 1.0),
-    ("EffectTexTranslateU", 0.0),
-    ("EffectTexTranslateV", 0.0),
-    ("EffectTexRotate", 0.0),
-    ("EffectTexScaleU", 8.0),
-    ("EffectTexScaleV", 5.0),
-    ("EffectColPower", 1.0)
-]
-
-matColors = [
-    ("ConstantColor0", 1.0, 1.0, 1.0),
-    ("ConstantColorSd0", 0.651, 0.7, 0.63),
-    ("ConstantColor1", 1.0, 1.0, 1.0),
-    ("ConstantColorSd1", 0.651, 0.7, 0.63),
-    ("L1ConstantColor0", 1.0, 1.0, 1.0),
-    ("L1AddColor0", 1.0, 1.0, 1.0),
-    ("L1ConstantColor1", 1.0, 1.0, 1.0),
-    ("L1AddColor1", 1.0, 1.0, 1.0),
-    ("L1ConstantColorSd0", 1.0, 1.0, 1.0),
-    ("L1ConstantColorSd1", 1.0, 1.0, 1.0),
-    ("DeepShadowColor", 1.0, 1.0, 1.0),
-    ("SpecularColor", 0.813333, 1.0, 0.65),
-    ("SphereMapColor", 1.000024, 1.000024, 1.000024),
-    ("RimColor", 0.314675, 0.41, 0.2255),
-    ("RimColorShadow", 0.1622, 0.2, 0.074),
-    ("ConstantColor", 1.0, 1.0, 1.0),
-    ("OnGameColor", 1.0, 1.0, 1.0),
-    ("OutLineCol", 0.39, 0.6, 0.46),
-    ("EffectColor01", 1.0, 0.0, 1.0)
-]
-
-matCommSwitch = [
-    ("FogEnable", 1),
-    ("DiscardEnable", 0),
-    ("CastShadow", 1),
-    ("ReceiveShadow", 0),
-    ("TextureAlphaTestEnable", 0),
-    ("ShadowMapPrevEnable", 1),
-    ("LayerCalcMulti", 0),
-    ("FireMaskPathEnable", 0),
-    ("GPUInstancingEnable", 0),
-    ("Wireframe", 0),
-    ("DepthWrite", 1),
-    ("DepthTest", 1),
-    ("IsErase", 0),
-    ("MayaPreviewEnable", 0)
-]
-
-matCommVals = [
-    ("CullMode", 0),
-    ("LightSetNo", 0),
-    ("ShaderType", 0),
-    ("Priority", 0),
-    ("MipMapBias", 0),
-    ("PreMultiplieMode", 0),
-    ("BlendMode", 0),
-    ("ColorMapUvIndex", 0),
-    ("Layer1UvIdx", 0),
-    ("EmissionMaskTexSS", 7),
-    ("AmbientTexSS", 7),
-    ("NormalMapTexSS", 7),
-    ("Col0TexSS", 7),
-    ("LyCol0TexSS", 7),
-    ("PolygonOffset", 0)
-]
-
-texMaps = [
-    "Col0Tex",
-    "EmissionMaskTex",
-    "LyCol0Tex",
-    "AmbientTex",
-    "NormalMapTex",
-    "LightTblTex",
-    "SphereMapTex",
-    "EffectTex"
-]
-
-matCommColors = [
-
-]
-
 MeshAttribute = [
     (VertexType.Position, BufferFormat.Float, 3),
     (VertexType.Normal, BufferFormat.HalfFloat, 4),
@@ -249,6 +102,20 @@ MeshAttribute = [
     (VertexType.BoneWeight, BufferFormat.BytesAsFloat, 4)
 ]
 
+# Formats tried for each attribute, smallest first. Anything not listed
+# keeps its MeshAttribute format. Short positions are snorm, so they only
+# fit meshes within -1..1.
+QuantizeProfiles = {
+    'FULL': {},
+    'COMPACT': {
+        VertexType.Position: [BufferFormat.Short, BufferFormat.HalfFloat, BufferFormat.Float],
+        VertexType.UV1: [BufferFormat.HalfFloat, BufferFormat.Float],
+        VertexType.UV2: [BufferFormat.HalfFloat, BufferFormat.Float],
+        VertexType.UV3: [BufferFormat.HalfFloat, BufferFormat.Float],
+        VertexType.UV4: [BufferFormat.HalfFloat, BufferFormat.Float],
+    },
+}
+
 # #####################################################
 # Utils
 # #####################################################
@@ -301,71 +168,31 @@ def RotateObj(obj, angle, axis):
 
     obj.matrix_world = orig_loc_mat @ rot_mat @ orig_rot_mat @ orig_scale_mat
     
-def GenerateWeightsAndIndices(mesh):
-    boneid = [0] * len(mesh.vertices)
-    weights = [0] * len(mesh.vertices)
-    arm_obj = [x for x in bpy.data.objects if x.type == 'ARMATURE'][0]
-    mesh_obj = [x for x in bpy.data.objects if x.type == 'MESH' and x.name == mesh.name][0]
-    b=0
-    # Iterate through bones and find associated vertex group with same name
-    for bone in arm_obj.data.bones:
-        for g in range(len(mesh_obj.vertex_groups)):
-            if bone.name == mesh_obj.vertex_groups[g].name:
-                # Iterate through vertex group to find verts associated with bone
-                for v in mesh.vertices:
-                    for vg in v.groups:
-                        if vg.group == g:
-                            boneid[v.index] = b
-                            weights[v.index] = vg.weight
-                            break
-                    else:
-                        continue
-                    break;
-        b+=1
-    return boneid, weights    
-    
-def CreateBoolSwitch(builder, entry):
-    str = builder.CreateString(entry[0])
-    b = entry[1]
-    
-    # create switch
-    Gfbmdl.MatSwitch.MatSwitchStart(builder)
-    Gfbmdl.MatSwitch.MatSwitchAddName(builder, str)
-    Gfbmdl.MatSwitch.MatSwitchAddValue(builder, b)
-    return Gfbmdl.MatSwitch.MatSwitchEnd(builder)
-    
-def CreateFloatValue(builder, val):
-    str = builder.CreateString(val[0])
-    f = val[1]
-    
-    # create value
-    Gfbmdl.MatFloat.MatFloatStart(builder)
-    Gfbmdl.MatFloat.MatFloatAddName(builder, str)
-    Gfbmdl.MatFloat.MatFloatAddValue(builder, f)
-    return Gfbmdl.MatFloat.MatFloatEnd(builder)
-    
-def CreateIntValue(builder, val):
-    str = builder.CreateString(val[0])
-    i = val[1]
-    
-    # create value
-    Gfbmdl.MatInt.MatIntStart(builder)
-    Gfbmdl.MatInt.MatIntAddName(builder, str)
-    Gfbmdl.MatInt.MatIntAddValue(builder, i)
-    return Gfbmdl.MatInt.MatIntEnd(builder)
-    
-def CreateColorValue(builder, col):
-    color = builder.CreateString(col[0])
-    
-    # create color
-    Gfbmdl.MatColor.MatColorStart(builder)
-    Gfbmdl.MatColor.MatColorAddName(builder, color)
-    Gfbmdl.MatColor.MatColorAddColor(builder, Gfbmdl.ColorRGB32.CreateColorRGB32(builder, col[1], col[2], col[3]))
-    return Gfbmdl.MatColor.MatColorEnd(builder)
- 
+# The armature the exported meshes are bound to, else the first one in the
+# scene. The bone table and every mesh's bone ids both come from it.
+def FindExportArmature():
+    for o in bpy.data.objects:
+        if o.type == 'MESH':
+            arm_obj = o.find_armature()
+            if arm_obj is not None:
+                return arm_obj
+    arms = [x for x in bpy.data.objects if x.type == 'ARMATURE']
+    return arms[0] if arms else None
+
+def GenerateWeightsAndIndices(mesh, obj, arm_obj):
+    if obj is None or arm_obj is None:
+        return SelectInfluences(InfluenceTable(numpy.zeros(len(mesh.vertices)), [], []), numpy.zeros(0, dtype=numpy.int64))
+    # Vertex group index -> bone index, then the 4 strongest influences per vertex
+    groupBones = MapGroupsToBones([g.name for g in obj.vertex_groups], [b.name for b in arm_obj.data.bones])
+    return SelectInfluences(GatherInfluences(mesh.vertices), groupBones)
+    
+    
 # #################################
 # Texture maps
 # #################################
+# Unknown1, WrapModeX/Y/Z, Unknown5-8, LodBias
+TextureMapping = (0, int(WrapMode.Mirror), int(WrapMode.Repeat), int(WrapMode.Repeat), 0, 0, 0, 0, 0.0)
+
 def GetMaterialTexIndex(name, mat):
     ind = 0 # dummy_col
     if name == "Col0Tex":
@@ -373,360 +200,294 @@ def GetMaterialTexIndex(name, mat):
         ind = arr[0] if len(arr) > 0 else 0
     return ind
 
-def CreateMapping(builder):
-    Gfbmdl.TextureMapping.TextureMappingStart(builder)
-    Gfbmdl.TextureMapping.TextureMappingAddUnknown1(builder, 0)
-    Gfbmdl.TextureMapping.TextureMappingAddWrapModeX(builder, WrapMode.Mirror)
-    Gfbmdl.TextureMapping.TextureMappingAddWrapModeY(builder, WrapMode.Repeat)
-    Gfbmdl.TextureMapping.TextureMappingAddWrapModeZ(builder, WrapMode.Repeat)
-    Gfbmdl.TextureMapping.TextureMappingAddUnknown5(builder, 0)
-    Gfbmdl.TextureMapping.TextureMappingAddUnknown6(builder, 0)
-    Gfbmdl.TextureMapping.TextureMappingAddUnknown7(builder, 0)
-    Gfbmdl.TextureMapping.TextureMappingAddUnknown8(builder, 0)
-    Gfbmdl.TextureMapping.TextureMappingAddLodBias(builder, 0.0)
-    return Gfbmdl.TextureMapping.TextureMappingEnd(builder)
-    
-def CreateTexMap(builder, prop, mat):
-    Name = builder.CreateString(prop)
-    mapping = CreateMapping(builder)
-    index = GetMaterialTexIndex(prop, mat)
-    
-    Gfbmdl.TextureMap.TextureMapStart(builder)
-    Gfbmdl.TextureMap.TextureMapAddSampler(builder, Name)
-    Gfbmdl.TextureMap.TextureMapAddIndex(builder, index)
-    Gfbmdl.TextureMap.TextureMapAddParams(builder, mapping)
-    return Gfbmdl.TextureMap.TextureMapEnd(builder)
-    
-# #################################
-# Material common
-# ################################# 
-def CreateCommonSwitch(builder):
-    switches = []
-    for s in matCommSwitch:
-        switches.append(CreateBoolSwitch(builder, s))
-    Gfbmdl.MaterialCommon.MaterialCommonStartSwitchesVector(builder, len(switches))
-    for s in reversed(switches):
-        builder.PrependUOffsetTRelative(s)
-    return builder.EndVector(len(switches))
-    
-def CreateCommonValues(builder):
-    values = []
-    for v in matCommVals:
-        values.append(CreateIntValue(builder, v))
-    Gfbmdl.MaterialCommon.MaterialCommonStartValuesVector(builder, len(values))
-    for v in reversed(values):
-        builder.PrependUOffsetTRelative(v)
-    return builder.EndVector(len(values))
-    
-def CreateCommonColors(builder):
-    colors = []
-    for c in matCommColors:
-        colors.append(CreateColorValue(builder, c))
-    Gfbmdl.MaterialCommon.MaterialCommonStartColorsVector(builder, len(colors))
-    for c in reversed(colors):
-        builder.PrependUOffsetTRelative(c)
-    return builder.EndVector(len(colors))
-    
-# #################################
-# Material
-# #################################
-def CreateMaterialTex(builder, mat):
-    maps = []
-    for t in texMaps:
-        maps.append(CreateTexMap(builder, t, mat))
-    Gfbmdl.Material.MaterialStartTextureMapsVector(builder, len(maps))
-    for t in reversed(maps):
-        builder.PrependUOffsetTRelative(t)
-    return builder.EndVector(len(maps))
-    
-def CreateMatSwitches(builder):
-    switches = []
-    for s in matSwitches:
-        switches.append(CreateBoolSwitch(builder, s))
-    Gfbmdl.Material.MaterialStartSwitchesVector(builder, len(switches))
-    for s in reversed(switches):
-        builder.PrependUOffsetTRelative(s)
-    return builder.EndVector(len(switches))
-    
-def CreateMatValues(builder):
-    values = []
-    for v in matValues:
-        values.append(CreateFloatValue(builder, v))
-    Gfbmdl.Material.MaterialStartValuesVector(builder, len(values))
-    for v in reversed(values):
-        builder.PrependUOffsetTRelative(v)
-    return builder.EndVector(len(values))
-    
-def CreateMatColors(builder):
-    colors = []
-    for c in matColors:
-        colors.append(CreateColorValue(builder, c))
-    Gfbmdl.Material.MaterialStartColorsVector(builder, len(colors))
-    for c in reversed(colors):
-        builder.PrependUOffsetTRelative(c)
-    return builder.EndVector(len(colors))
-    
-def CreateMatCommon(builder):
-    switch = CreateCommonSwitch(builder)
-    vals = CreateCommonValues(builder)
-    cols = CreateCommonColors(builder)
-    
-    Gfbmdl.MaterialCommon.MaterialCommonStart(builder)
-    Gfbmdl.MaterialCommon.MaterialCommonAddSwitches(builder, switch)
-    Gfbmdl.MaterialCommon.MaterialCommonAddValues(builder, vals)
-    #Gfbmdl.MaterialCommon.MaterialCommonAddColors(builder, cols)
-    return Gfbmdl.MaterialCommon.MaterialCommonEnd(builder)
-    
-def CreateMaterial(builder, mat):
-    # make strings first
-    Name = builder.CreateString(mat.name)
-    Shdr = builder.CreateString("PokeDefaultShader")
-    
-    # build components
-    tex = CreateMaterialTex(builder, mat)
-    switches = CreateMatSwitches(builder)
-    vals = CreateMatValues(builder)
-    cols = CreateMatColors(builder)
-    common = CreateMatCommon(builder)
-    
-    # build material
-    debug("Creating Material object. [%s]" % Name)
-    Gfbmdl.Material.MaterialStart(builder)
-    Gfbmdl.Material.MaterialAddName(builder, Name)
-    Gfbmdl.Material.MaterialAddShaderGroup(builder, Shdr)
-    Gfbmdl.Material.MaterialAddRenderLayer(builder, 0)
-    Gfbmdl.Material.MaterialAddUnknown1(builder, 1)
-    Gfbmdl.Material.MaterialAddUnknown2(builder, 1)
-    Gfbmdl.Material.MaterialAddParameter1(builder, 0)
-    Gfbmdl.Material.MaterialAddParameter2(builder, 0)
-    Gfbmdl.Material.MaterialAddParameter3(builder, 0)
-    Gfbmdl.Material.MaterialAddShaderIndex(builder, 0)
-    Gfbmdl.Material.MaterialAddParameter4(builder, 0)
-    Gfbmdl.Material.MaterialAddParameter5(builder, 0)
-    Gfbmdl.Material.MaterialAddTextureMaps(builder, tex)
-    Gfbmdl.Material.MaterialAddSwitches(builder, switches)
-    Gfbmdl.Material.MaterialAddValues(builder, vals)
-    Gfbmdl.Material.MaterialAddColors(builder, cols)
-    Gfbmdl.Material.MaterialAddUnknown3(builder, 0)
-    Gfbmdl.Material.MaterialAddUnknown4(builder, 1)
-    Gfbmdl.Material.MaterialAddUnknown5(builder, 0)
-    Gfbmdl.Material.MaterialAddUnknown6(builder, 0)
-    Gfbmdl.Material.MaterialAddUnknown7(builder, 0)
-    Gfbmdl.Material.MaterialAddCommon(builder, common)
-    return Gfbmdl.Material.MaterialEnd(builder)
+# Custom properties named after a preset parameter override it
+def GetMaterialOverrides(mat):
+    overrides = {}
+    for k in mat.keys():
+        v = mat[k]
+        if hasattr(v, "to_list"):
+            v = v.to_list()
+        if isinstance(v, (int, float)) or (isinstance(v, list) and all(isinstance(x, (int, float)) for x in v)):
+            overrides[k] = v
+    return overrides
+
+def GetMaterialPreset(mat):
+    shaderGroup = mat.get("ShaderGroup", DEFAULT_SHADER)
+    preset = GetPreset(shaderGroup)
+    if preset is None:
+        debug("No preset for shader %s, using %s" % (shaderGroup, DEFAULT_SHADER))
+        preset = GetPreset(DEFAULT_SHADER)
+    return preset.Resolve(GetMaterialOverrides(mat), mat.name)
+    
+def GatherMaterial(mat):
+    preset = GetMaterialPreset(mat)
+    debug("Creating Material object. [%s]" % mat.name)
+    
+    desc = MaterialDesc(mat.name, preset.Name)
+    desc.Unknown1 = 1
+    desc.Unknown2 = 1
+    desc.Unknown4 = 1
+    desc.TextureMaps = tuple((t, GetMaterialTexIndex(t, mat), TextureMapping) for t in preset.TextureMaps)
+    
+    # Identical blocks are shared between materials by the encoder
+    desc.Switches = preset.Switches
+    desc.Values = preset.Values
+    desc.Colors = preset.Colors
+    desc.CommonSwitches = preset.CommonSwitches
+    desc.CommonValues = preset.CommonValues
+    # Common colors are left out of the file
+    return desc
 
 # #################################
 # Group data
 # #################################
-def CreateGroup(builder, boneid, meshid, bound):
-    bb = bounds(bound)
-    
-    Gfbmdl.Group.GroupStart(builder)
-    Gfbmdl.Group.GroupAddBoneIndex(builder, boneid)
-    Gfbmdl.Group.GroupAddMeshIndex(builder, meshid)
-    Gfbmdl.Group.GroupAddBounding(builder, CreateBoundBox(builder, bb.x.min, bb.y.min, bb.z.min, bb.x.max, bb.y.max, bb.z.max))
-    return Gfbmdl.Group.GroupEnd(builder)
+# World space bounds of a set of mesh positions
+def ChunkBounds(obj, pos):
+    if len(pos) == 0:
+        return numpy.zeros(3), numpy.zeros(3)
+    if obj is not None:
+        m = numpy.array(obj.matrix_world, dtype=numpy.float64)
+        pos = pos @ m[:3, :3].T + m[:3, 3]
+    return pos.min(axis=0), pos.max(axis=0)
 
 # #################################
 # Mesh data
 # #################################
-def CalculateBufferStride():
-    global use_binormals
-    global has_UVs
-    global has_Colors
-    global has_bones
-    stride = 20
-    if use_binormals:
-        stride += 8
-    for c in range(4):
-        if not has_Colors[c]:
-            continue
-        stride += 4
+# Vertex groups named after bones of the exported armature
+def HasSkinning(obj, arm_obj):
+    if obj is None or arm_obj is None or len(obj.vertex_groups) == 0:
+        return False
+    boneNames = set(b.name for b in arm_obj.data.bones)
+    return any(g.name in boneNames for g in obj.vertex_groups)
+
+# Byte bone ids only reach the first 256 bones of the armature
+def BoneIDAttribute(arm_obj):
+    if BoneIdType(len(arm_obj.data.bones)) == numpy.uint16:
+        return (VertexType.BoneID, BufferFormat.Short, 4)
+    return MeshAttribute[VertexType.BoneID]
+
+# Only the attributes the mesh actually has
+def GetMeshLayout(mesh, obj, arm_obj):
+    uvCnt = min(len(mesh.uv_layers), 4)
+    colCnt = min(len(mesh.vertex_colors), 4)
+    
+    layout = []
+    layout.append(MeshAttribute[VertexType.Position])
+    layout.append(MeshAttribute[VertexType.Normal])
+    # Tangents need a UV map
+    if uvCnt > 0:
+        layout.append(MeshAttribute[VertexType.Binormal])
+    for u in range(uvCnt):
+        layout.append(MeshAttribute[VertexType.UV1 + u])
+    for c in range(colCnt):
+        layout.append(MeshAttribute[VertexType.Color1 + c])
+    if HasSkinning(obj, arm_obj):
+        layout.append(BoneIDAttribute(arm_obj))
+        layout.append(MeshAttribute[VertexType.BoneWeight])
+    return layout
+
+# Largest error allowed for a lossy format, positions relative to the mesh
+# bounds, UVs to half a texel of a 1024 texture
+def QuantizeTolerance(vtype, values):
+    if vtype == VertexType.Position:
+        extent = numpy.ptp(values, axis=0).max() if len(values) else 0.0
+        return max(extent, 1e-6) / 4096.0
+    return 1.0 / 2048.0
+
+# Picks the format of every attribute from the active profile, falling back
+# to a wider one when the measured error is too large
+def QuantizeLayout(layout, attribs, profile):
+    candidates = QuantizeProfiles[profile]
+    ret = []
+    for vtype, format, count in layout:
+        if vtype in attribs and vtype != VertexType.BoneID:
+            values = attribs[vtype][:, :count]
+            if vtype in candidates:
+                format, maxErr, rms = ChooseFormat(values, vtype, candidates[vtype], QuantizeTolerance(vtype, values))
+            else:
+                maxErr, rms = MeasureError(values, vtype, format)
+            debug("%s as %s: max error %g, rms %g" % (VertexType(vtype).name, BufferFormat(format).name, maxErr, rms))
+        ret.append((vtype, format, count))
+    return ret
+    
+# Tangent frames from the UV gradient of every loop triangle, for meshes
+# calc_tangents refuses (it only takes tris and quads). Loops sharing a
+# vertex and UV are smoothed together like MikkTSpace does.
+def TriangleBinormals(mesh, pos, norm):
+    loopCnt = len(mesh.loops)
+    uv = numpy.zeros(loopCnt * 2, dtype=numpy.float32)
+    mesh.uv_layers.active.data.foreach_get("uv", uv)
+    uv = uv.reshape(-1, 2).astype(numpy.float64)
+    mesh.calc_loop_triangles()
+    tris = numpy.zeros(len(mesh.loop_triangles) * 3, dtype=numpy.int32)
+    mesh.loop_triangles.foreach_get("loops", tris)
+    tris = tris.reshape(-1, 3)
+    
+    p = pos.astype(numpy.float64)[tris]
+    t = uv[tris]
+    e1 = p[:, 1] - p[:, 0]
+    e2 = p[:, 2] - p[:, 0]
+    d1 = t[:, 1] - t[:, 0]
+    d2 = t[:, 2] - t[:, 0]
+    det = d1[:, 0] * d2[:, 1] - d2[:, 0] * d1[:, 1]
+    r = numpy.where(det == 0.0, 0.0, 1.0 / numpy.where(det == 0.0, 1.0, det))[:, None]
+    triTan = (e1 * d2[:, 1:] - e2 * d1[:, 1:]) * r
+    triBi = (e2 * d1[:, :1] - e1 * d2[:, :1]) * r
+    
+    # Sum over every loop of a (vertex, uv) group
+    loopVerts = numpy.zeros(loopCnt, dtype=numpy.int32)
+    mesh.loops.foreach_get("vertex_index", loopVerts)
+    keys = numpy.column_stack((loopVerts.astype(numpy.float64), uv))
+    group = numpy.unique(keys, axis=0, return_inverse=True)[1].ravel()
+    groupCnt = int(group.max()) + 1 if loopCnt else 0
+    tan = numpy.zeros((groupCnt, 3))
+    bi = numpy.zeros((groupCnt, 3))
+    numpy.add.at(tan, group[tris].ravel(), numpy.repeat(triTan, 3, axis=0))
+    numpy.add.at(bi, group[tris].ravel(), numpy.repeat(triBi, 3, axis=0))
+    tan = tan[group]
+    bi = bi[group]
+    
+    # Orthogonalize against the split normal, keep the UV handedness
+    n = norm.astype(numpy.float64)
+    tan -= n * (n * tan).sum(axis=1)[:, None]
+    tan /= numpy.maximum(numpy.linalg.norm(tan, axis=1), 1e-12)[:, None]
+    ret = numpy.cross(n, tan)
+    ret[(ret * bi).sum(axis=1) < 0.0] *= -1.0
+    return ret.astype(numpy.float32)
+
+def CalculateBinormals(mesh, pos, norm):
+    sides = numpy.zeros(len(mesh.polygons), dtype=numpy.int32)
+    mesh.polygons.foreach_get("loop_total", sides)
+    if len(sides) and sides.max() > 4:
+        return TriangleBinormals(mesh, pos, norm)
+    mesh.calc_tangents()
+    bi = numpy.zeros(len(mesh.loops) * 3, dtype=numpy.float32)
+    mesh.loops.foreach_get("bitangent", bi)
+    return bi.reshape(-1, 3)
+
+# Encodes one vertex per loop and welds identical ones. Returns the vertex
+# buffer, the vertex index of every loop and the layout used.
+def GenerateVertexBuffer(mesh, obj, options):
+    layout = GetMeshLayout(mesh, obj, options.Armature)
+    types = set(a[0] for a in layout)
+    
+    vertCnt = len(mesh.vertices)
+    loopCnt = len(mesh.loops)
+    loopVerts = numpy.zeros(loopCnt, dtype=numpy.int32)
+    mesh.loops.foreach_get("vertex_index", loopVerts)
+    attribs = {}
+    
+    # Populate positions and split normals
+    pos = numpy.zeros(vertCnt * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("co", pos)
+    attribs[VertexType.Position] = pos.reshape(-1, 3)[loopVerts]
+    mesh.calc_normals_split()
+    norm = numpy.zeros(loopCnt * 3, dtype=numpy.float32)
+    mesh.loops.foreach_get("normal", norm)
+    attribs[VertexType.Normal] = norm.reshape(-1, 3)
+    if VertexType.Binormal in types:
+        attribs[VertexType.Binormal] = CalculateBinormals(mesh, attribs[VertexType.Position], attribs[VertexType.Normal])
+    
+    # Populate UVs
     for u in range(4):
-        if not has_UVs[u]:
-            continue
-        stride += 8
-    if has_bones:
-        stride += 8
-    return stride
-    
-def CalculateBinormals(mesh):
-    if not has_UVs[0]:
-        bi = [(0.0, 0.0, 0.0)] * len(mesh.vertices)
-        return bi
-    bi = []
-    mesh.calc_tangents() # slow as all  fuck
-    for l in mesh.loops:
-        bi.append(l.bitangent_sign * l.normal.cross(l.tangent))
-    return bi
-
-def GenerateVertexBuffer(mesh):
-    global use_binormals
-    global has_UVs
-    global has_Colors
-    global has_bones
-    
-    stride = CalculateBufferStride()
-    debug("Vertex buffer stride: %d" % stride)
+        if VertexType.UV1 + u in types:
+            debug("Vertex UV count: %d" % len(mesh.uv_layers[u].data))
+            uv = numpy.zeros(loopCnt * 2, dtype=numpy.float32)
+            mesh.uv_layers[u].data.foreach_get("uv", uv)
+            attribs[VertexType.UV1 + u] = uv.reshape(-1, 2)
     
-    buff = bytearray(len(mesh.vertices)*stride)
     # Populate colors
-    cols = []
-    col = []
     for c in range(4):
-        if has_Colors[c]:
-            # Writing colors from vert color object
-            if len(mesh.vertex_colors) > c:
-                debug("Vertex color1 count: %d" % len(mesh.vertex_colors[c].data))
-                for i in range(len(mesh.vertex_colors[c].data)):
-                    r = int(mesh.vertex_colors[c].data[i].color[0] * 255)
-                    g = int(mesh.vertex_colors[c].data[i].color[1] * 255)
-                    b = int(mesh.vertex_colors[c].data[i].color[2] * 255)
-                    a = int(mesh.vertex_colors[c].data[i].color[3] * 255)
-                    col.append(((r << 24)&0xFF000000) | ((g << 16)&0xFF0000) | ((b << 8)&0xFF00) | a&0xFF)
-                cols.append(col)
-            # If no color object is found, create default one
-            else:
-                for c in range(len(mesh.vertices)):
-                    col.append(int(0xFF000000))
-                cols.append(col)
-        
-    # Populate UVs
-    uvs = []
-    uv = []
-    for u in range(4):
-        if has_UVs[u]:
-            if len(mesh.uv_layers) > u:
-                debug("Vertex UV count: %d" % len(mesh.uv_layers[u].data))
-                for i in mesh.uv_layers[u].data:
-                    uv.append(i.uv)
-                uvs.append(uv)
-
-    # Pack data
-    for i in range(len(mesh.vertices)):
-        binormal = CalculateBinormals(mesh)
-        pos = mesh.vertices[i].co
-        norm = mesh.vertices[i].normal
-        boneids, weights = GenerateWeightsAndIndices(mesh)
-        baseOff = int(i*stride)
-        off = 0
-        # Pack vert/face data
-        struct.pack_into('3f', buff, baseOff, pos[0], pos[1], pos[2])
-        struct.pack_into('4e', buff, baseOff+12, norm[0], norm[1], norm[2], 0.0)
-        off += 20
-        if use_binormals:
-            struct.pack_into('4e', buff, baseOff+off, binormal[i][0], binormal[i][1], binormal[i][2], 0.0)
-            off += 8
-        # Pack UVs
-        for u in uvs:
-            struct.pack_into('2f', buff, baseOff+off, u[i][0], u[i][1])
-            off += 8
-        # Pack colors
-        for c in cols:
-            struct.pack_into('I', buff, baseOff+off, c[i])
-            off += 4
-        # Pack bone data
-        if has_bones:
-            struct.pack_into('I', buff, baseOff+off, boneids[i])
-            off += 4
-            struct.pack_into('f', buff, baseOff+off, weights[i])
-    return buff
-
-def CreatePolyFaces(builder, gons):
-    Gfbmdl.MeshPolygon.MeshPolygonStartFacesVector(builder, len(gons))
-    for g in reversed(gons):
-        builder.PrependUint16(g)
-    return builder.EndVector(len(gons))
-
-def CreatePolygon(builder, mesh, id):
-    gons = []
-    for p in mesh.polygons:
-        if p.material_index == id:
-            for v in p.vertices:
-                gons.append(v)
-    if len(gons) > 0:
-        data = CreatePolyFaces(builder, gons)
-    else:
-        data = 0
+        if VertexType.Color1 + c in types:
+            debug("Vertex color%d count: %d" % (c + 1, len(mesh.vertex_colors[c].data)))
+            col = numpy.zeros(loopCnt * 4, dtype=numpy.float32)
+            mesh.vertex_colors[c].data.foreach_get("color", col)
+            attribs[VertexType.Color1 + c] = col.reshape(-1, 4)
+    
+    # Populate bone data
+    if VertexType.BoneID in types:
+        boneids, weights = GenerateWeightsAndIndices(mesh, obj, options.Armature)
+        attribs[VertexType.BoneID] = boneids[loopVerts]
+        attribs[VertexType.BoneWeight] = weights[loopVerts] / numpy.float32(255.0)
+    
+    layout = QuantizeLayout(layout, attribs, options.Quantization)
+    stride = BuildVertexDtype(layout).itemsize
+    debug("Vertex buffer stride: %d" % stride)
+    
+    # Interleave everything into the stride, then keep only unique vertices
+    verts, loopIndices = WeldVertices(EncodeVertexBuffer(attribs, layout, loopCnt))
+    debug("Welded %d loops into %d vertices" % (loopCnt, len(verts)))
+    profiling.Count("vertices", len(verts))
+    return verts, loopIndices, layout
+
+def GetMeshTriangles(mesh):
+    mesh.calc_loop_triangles()
+    triCnt = len(mesh.loop_triangles)
+    triLoops = numpy.zeros(triCnt * 3, dtype=numpy.int32)
+    triMats = numpy.zeros(triCnt, dtype=numpy.int32)
+    mesh.loop_triangles.foreach_get("loops", triLoops)
+    mesh.loop_triangles.foreach_get("material_index", triMats)
+    profiling.Count("triangles", triCnt)
+    return triLoops.reshape(-1, 3), triMats
+
+def GatherMeshPolygons(faces, triMats, matCnt):
+    # Group every triangle by material in one sort
+    order = numpy.argsort(triMats, kind='stable')
+    faces = faces[order]
+    spans = numpy.searchsorted(triMats[order], numpy.arange(matCnt + 1))
     
-    Gfbmdl.MeshPolygon.MeshPolygonStart(builder)
-    Gfbmdl.MeshPolygon.MeshPolygonAddMaterialIndex(builder, id)
-    Gfbmdl.MeshPolygon.MeshPolygonAddFaces(builder, data)
-    return Gfbmdl.MeshPolygon.MeshPolygonEnd(builder)
-
-def CreateMeshPolygons(builder, mesh):
     poly = []
-    for id in range(len(mesh.materials)):
-        poly.append(CreatePolygon(builder, mesh, id))
-    Gfbmdl.Mesh.MeshStartPolygonsVector(builder, len(poly))
-    for a in reversed(poly):
-        builder.PrependUOffsetTRelative(a)
-    return builder.EndVector(len(poly))
-
-def CreateAttribute(builder, align):
-    type = int(align[0])
-    format = int(align[1])
-    count = align[2]
-    
-    Gfbmdl.MeshAttribute.MeshAttributeStart(builder)
-    Gfbmdl.MeshAttribute.MeshAttributeAddVertexType(builder, type)
-    Gfbmdl.MeshAttribute.MeshAttributeAddBufferFormat(builder, format)
-    Gfbmdl.MeshAttribute.MeshAttributeAddElementCount(builder, count)
-    return Gfbmdl.MeshAttribute.MeshAttributeEnd(builder)
-    
-def CreateMeshAttributes(builder):
-    global use_binormals
-    global has_UVs
-    global has_Colors
-    global has_bones
-    
-    attrib = []
-    attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.Position]))
-    attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.Normal]))
-    if use_binormals:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.Binormal]))
-    if has_UVs[0]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.UV1]))
-    if has_UVs[1]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.UV2]))
-    if has_UVs[2]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.UV3]))
-    if has_UVs[3]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.UV4]))
-    if has_Colors[0]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.Color1]))
-    if has_Colors[1]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.Color2]))
-    if has_Colors[2]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.Color3]))
-    if has_Colors[3]:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.Color4]))
-    if has_bones:
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.BoneID]))
-        attrib.append(CreateAttribute(builder, MeshAttribute[VertexType.BoneWeight]))
-        
-    Gfbmdl.Mesh.MeshStartAttributesVector(builder, len(attrib))
-    for a in reversed(attrib):
-        builder.PrependUOffsetTRelative(a)
-    return builder.EndVector(len(attrib))
-    
-def CreateMeshData(builder, mesh):
-    data = GenerateVertexBuffer(mesh)
-    Gfbmdl.Mesh.MeshStartDataVector(builder, len(data))
-    for d in reversed(data):
-        builder.PrependByte(d)
-    return builder.EndVector(len(data))
-
-def CreateMesh(builder, mesh):
-    polys = CreateMeshPolygons(builder, mesh)
-    attrib = CreateMeshAttributes(builder)
-    data = CreateMeshData(builder, mesh)
-    
-    Gfbmdl.Mesh.MeshStart(builder)
-    Gfbmdl.Mesh.MeshAddPolygons(builder, polys)
-    Gfbmdl.Mesh.MeshAddAttributes(builder, attrib)
-    Gfbmdl.Mesh.MeshAddData(builder, data)
-    return Gfbmdl.Mesh.MeshEnd(builder)
+    for id in range(matCnt):
+        poly.append((id, faces[spans[id]:spans[id + 1]].ravel().astype('<u2')))
+    return poly
+
+# Cache orders every material's triangles, then renumbers the vertices in
+# the order the GPU fetches them
+def OptimizeChunk(chunk, pos):
+    # Degenerate triangles draw nothing
+    f = chunk.Faces
+    keep = (f[:, 0] != f[:, 1]) & (f[:, 1] != f[:, 2]) & (f[:, 0] != f[:, 2])
+    order = numpy.argsort(chunk.Materials[keep], kind='stable')
+    faces = f[keep][order]
+    mats = chunk.Materials[keep][order]
+    acmr, atvr = CacheStats(faces)
+    
+    parts = []
+    for m in numpy.unique(mats):
+        parts.append(OptimizeOverdraw(OptimizeVertexCache(faces[mats == m]), pos))
+    if parts:
+        faces = numpy.concatenate(parts)
+    vertOrder, remap = OptimizeVertexFetch(faces, len(chunk.Vertices))
+    faces = remap[faces]
+    
+    newAcmr, newAtvr = CacheStats(faces)
+    debug("ACMR %.3f -> %.3f, ATVR %.3f -> %.3f" % (acmr, newAcmr, atvr, newAtvr))
+    return MeshChunk(chunk.Vertices[vertOrder], faces, mats)
+
+def GatherMeshChunk(verts, layout, pos, chunk, matCnt, options):
+    if options.Optimize:
+        with profiling.Phase("optimize"):
+            chunk = OptimizeChunk(chunk, pos[chunk.Vertices])
+    with profiling.Phase("buffer packing"):
+        data = verts[chunk.Vertices].view(numpy.uint8)
+    return MeshDesc(layout, data, GatherMeshPolygons(chunk.Faces, chunk.Materials, matCnt))
+
+# One Gfbmdl mesh per chunk of at most 65535 vertices, returns
+# (mesh, world bounds) for each
+def GatherMesh(mesh, obj, options):
+    with profiling.Phase("buffer packing"):
+        verts, loopIndices, layout = GenerateVertexBuffer(mesh, obj, options)
+    with profiling.Phase("faces"):
+        triLoops, triMats = GetMeshTriangles(mesh)
+        chunks = SplitTriangles(loopIndices[triLoops], triMats)
+    if len(chunks) > 1:
+        debug("Splitting %s into %d meshes" % (mesh.name, len(chunks)))
+    
+    pos = DecodeVertexBuffer(verts.view(numpy.uint8), layout)[VertexType.Position].astype(numpy.float64)
+    ret = []
+    for chunk in chunks:
+        ret.append((GatherMeshChunk(verts, layout, pos, chunk, len(mesh.materials), options), ChunkBounds(obj, pos[chunk.Vertices])))
+    return ret
 
 # #################################
 # Collision data
@@ -743,38 +504,7 @@ def CreateCollisionGroup(builder):
 # #################################
 # Model data
 # #################################
-def GetBoneIndex(bone):
-    i=0
-    if bone == None:
-        return -1
-    for b in bpy.data.armatures[0].bones:
-        if (b.name == bone.name):
-            return i
-        i+=1
-    return -1
-    
-def CreateBone(builder, bone):
-    Name = builder.CreateString(bone.name)
-
-    Gfbmdl.Bone.BoneStart(builder)
-    Gfbmdl.Bone.BoneAddName(builder, Name)
-    Gfbmdl.Bone.BoneAddBoneType(builder, int(bone.use_deform))
-    Gfbmdl.Bone.BoneAddParent(builder, GetBoneIndex(bone.parent))
-    Gfbmdl.Bone.BoneAddZero(builder, 0)
-    Gfbmdl.Bone.BoneAddVisible(builder, int(bone.use_deform))
-    Gfbmdl.Bone.BoneAddScale(builder, Gfbmdl.Vector3.CreateVector3(builder, 1.0, 1.0, 1.0))
-    Gfbmdl.Bone.BoneAddRotation(builder, Gfbmdl.Vector3.CreateVector3(builder, 0.0, 0.0, 0.0))
-    Gfbmdl.Bone.BoneAddTranslation(builder, Gfbmdl.Vector3.CreateVector3(builder, bone.head[0], bone.head[1], bone.head[2]))
-    Gfbmdl.Bone.BoneAddRadiusStart(builder, Gfbmdl.Vector3.CreateVector3(builder, 0.0, 0.0, 0.0))
-    Gfbmdl.Bone.BoneAddRadiusEnd(builder, 0)
-    Gfbmdl.Bone.BoneAddRigidCheck(builder, 0)
-    return Gfbmdl.Bone.BoneEnd(builder)
-    
-def CreateBoundBox(builder, x1, y1, z1, x2, y2, z2):
-    bb = Gfbmdl.BoundingBox.CreateBoundingBox(builder, x1, y1, z1, x2, y2, z2)
-    return bb
-    
-def CreateTexNames(builder):
+def GatherTexNames():
     names = []
     textures = []
     for ob in bpy.data.objects:
@@ -783,129 +513,98 @@ def CreateTexNames(builder):
                 if mat_slot.material:
                     if mat_slot.material.node_tree:
                         textures.extend([x for x in mat_slot.material.node_tree.nodes if x.type=='TEX_IMAGE'])
-    size = len(textures)
-    debug("Textures: %d" % size)
+    debug("Textures: %d" % len(textures))
     for n in textures:
-        names.append(builder.CreateString(n.image.name))
+        names.append(n.image.name)
         debug(n.image.name)
-    Gfbmdl.Model.ModelStartTextureNamesVector(builder, size)
-    for n in reversed(names):
-        builder.PrependUOffsetTRelative(n)
-    return builder.EndVector(size)
+    return names
     
-def CreateMatNames(builder):
-    names = []
-    size = len(bpy.data.materials)
-    debug("Materials: %d" % size)
-    for n in bpy.data.materials:
-        names.append(builder.CreateString(n.name))
-    Gfbmdl.Model.ModelStartMaterialNamesVector(builder, size)
-    for n in reversed(names):
-        builder.PrependUOffsetTRelative(n)
-    return builder.EndVector(size)
-    
-def CreateShaderNames(builder):
-    names = []
-    size = len(bpy.data.materials)
-    debug("Shaders: %d" % size)
-    for n in bpy.data.materials:
-        names.append(builder.CreateString(n.name))
-    Gfbmdl.Model.ModelStartShaderNamesVector(builder, size)
-    for n in reversed(names):
-        builder.PrependUOffsetTRelative(n)
-    return builder.EndVector(size)
-    
-def CreateUnknown(builder):
-    Gfbmdl.Model.ModelStartUnknownVector(builder, 0)
-    return builder.EndVector(0)
-    
-def CreateMaterials(builder):
-    mats = []
-    size = len(bpy.data.materials)
-    for n in bpy.data.materials:
-        mats.append(CreateMaterial(builder, n))
-    Gfbmdl.Model.ModelStartMaterialsVector(builder, size)
-    for n in reversed(mats):
-        builder.PrependUOffsetTRelative(n)
-    return builder.EndVector(size)
-    
-def CreateGroups(builder):
+def GatherMatNames():
+    debug("Materials: %d" % len(bpy.data.materials))
+    return [n.name for n in bpy.data.materials]
+    
+def GatherShaderNames():
+    debug("Shaders: %d" % len(bpy.data.materials))
+    return [n.name for n in bpy.data.materials]
+    
+# Groups tie every mesh to the bone named after its object
+def GatherGroups(meshGroups, arm_obj):
     groups = []
-    meshBounds = [x for x in bpy.data.objects if x.type == 'MESH']
-    for g in range(len(bpy.data.meshes)):
-        groups.append(CreateGroup(builder, 0, g, meshBounds[g]))
-    Gfbmdl.Model.ModelStartGroupsVector(builder, len(groups))
-    for g in reversed(groups):
-        builder.PrependUOffsetTRelative(g)
-    return builder.EndVector(len(groups))
-    
-def CreateMeshes(builder):
+    boneNames = [b.name for b in arm_obj.data.bones] if arm_obj is not None else []
+    boneIndex = BoneIndexMap(boneNames)
+    for g, (name, bbMin, bbMax) in enumerate(meshGroups):
+        groups.append((boneIndex.get(name, 0), g, bbMin.tolist(), bbMax.tolist()))
+    return groups
+    
+def GatherMeshes(options):
     meshes = []
+    meshGroups = []
+    meshObjs = dict((o.data.name, o) for o in bpy.data.objects if o.type == 'MESH')
     for m in bpy.data.meshes:
-        meshes.append(CreateMesh(builder, m))
-    Gfbmdl.Model.ModelStartMeshesVector(builder, len(meshes))
-    for m in reversed(meshes):
-        builder.PrependUOffsetTRelative(m)
-    return builder.EndVector(len(meshes))
-    
-def CreateBones(builder):
-    bones = []
+        obj = meshObjs.get(m.name)
+        for mesh, (bbMin, bbMax) in GatherMesh(m, obj, options):
+            meshes.append(mesh)
+            meshGroups.append((obj.name if obj is not None else m.name, bbMin, bbMax))
+    return meshes, meshGroups
+    
+def GatherBones(desc, arm_obj):
     # Leave stub if no armature
-    if len(bpy.data.armatures) <= 0:
-        Gfbmdl.Model.ModelStartMeshesVector(builder, 0)
-        return builder.EndVector(0)
+    if arm_obj is None:
         return
-    # Get first armature data.. should only be one
-    arm = bpy.data.armatures[0]
-    print("Total bones: %d" % len(arm.bones))
-    for b in arm.bones:
-        bones.append(CreateBone(builder, b))
-    Gfbmdl.Model.ModelStartMeshesVector(builder, len(arm.bones))
-    for b in reversed(bones):
-        builder.PrependUOffsetTRelative(b)
-    return builder.EndVector(len(arm.bones))
-    
-def CreateCollisionData(builder):
-    Gfbmdl.Model.ModelStartCollisionGroupsVector(builder, 0)
-    return builder.EndVector(0)
-        
-def get_model_string( ctxt ):
+    arm = arm_obj.data
+    boneCnt = len(arm.bones)
+    print("Total bones: %d" % boneCnt)
+    
+    # Armature space rest matrices back to parent relative TRS
+    boneIndex = BoneIndexMap([b.name for b in arm.bones])
+    parents = numpy.array([boneIndex[b.parent.name] if b.parent else -1 for b in arm.bones], dtype=numpy.int32)
+    world = numpy.zeros(boneCnt * 16, dtype=numpy.float32)
+    arm.bones.foreach_get("matrix_local", world)
+    world = world.reshape(-1, 4, 4).transpose(0, 2, 1).astype(numpy.float64)
+    trans, rot, scale = DecomposeMatrices(SolveLocalMatrices(world, parents))
+    deform = numpy.zeros(boneCnt, dtype=numpy.bool_)
+    arm.bones.foreach_get("use_deform", deform)
+    
+    desc.BoneNames = list(boneIndex)
+    desc.BoneTypes = deform.astype(numpy.uint32)
+    desc.BoneParents = parents
+    desc.BoneVisible = deform
+    desc.BoneScales = scale
+    desc.BoneRotations = rot
+    desc.BoneTranslations = trans
+    desc.BoneRadiusStart = numpy.zeros((boneCnt, 3))
+    
+def get_model_string( ctxt, options=None ):
+    if options is None:
+        options = ExportOptions()
+    
     # Orient properly
     obj = [o for o in bpy.context.scene.objects if o.type == 'MESH' or o.type == 'ARMATURE']
     for o in obj:
         RotateObj(o, -90, 'X')
         
     try:
-        builder = flatbuffers.Builder(0)
-        details = bounds(([x for x in bpy.data.objects if x.type == 'ARMATURE'])[0])
+        options.Armature = FindExportArmature()
+        desc = ModelDesc()
+        details = bounds(options.Armature)
+        desc.Bounding = (details.x.min, details.y.min, details.z.min, details.x.max, details.y.max, details.z.max)
         
-        texNames = CreateTexNames(builder)
-        shdrNames = CreateShaderNames(builder)
-        unk = CreateUnknown(builder)
-        matNames = CreateMatNames(builder)
-        mats = CreateMaterials(builder)
-        group = CreateGroups(builder)
-        mesh = CreateMeshes(builder)
-        bones = CreateBones(builder)
-        colData = CreateCollisionData(builder)
+        with profiling.Phase("names"):
+            desc.TextureNames = GatherTexNames()
+            desc.ShaderNames = GatherShaderNames()
+            desc.MaterialNames = GatherMatNames()
+        with profiling.Phase("materials"):
+            desc.Materials = [GatherMaterial(m) for m in bpy.data.materials]
+        with profiling.Phase("meshes"):
+            desc.Meshes, meshGroups = GatherMeshes(options)
+        with profiling.Phase("groups"):
+            desc.Groups = GatherGroups(meshGroups, options.Armature)
+        with profiling.Phase("bones"):
+            GatherBones(desc, options.Armature)
         
         # Build Model
         debug("Creating model object.")
-        Gfbmdl.Model.ModelStart(builder)
-        Gfbmdl.Model.ModelAddVersion(builder, 403704096)
-        Gfbmdl.Model.ModelAddBounding(builder, CreateBoundBox(builder, details.x.min, details.y.min, details.z.min, details.x.max, details.y.max, details.z.max))
-        Gfbmdl.Model.ModelAddTextureNames(builder, texNames)
-        Gfbmdl.Model.ModelAddShaderNames(builder, shdrNames)
-        Gfbmdl.Model.ModelAddUnknown(builder, unk)
-        Gfbmdl.Model.ModelAddMaterialNames(builder, matNames)
-        Gfbmdl.Model.ModelAddMaterials(builder, mats)
-        Gfbmdl.Model.ModelAddGroups(builder, group)
-        Gfbmdl.Model.ModelAddMeshes(builder, mesh)
-        Gfbmdl.Model.ModelAddBones(builder, bones)
-        Gfbmdl.Model.ModelAddCollisionGroups(builder, colData)
-        model = Gfbmdl.Model.ModelEnd(builder)
-        
-        builder.Finish(model)
+        data = EncodeModel(desc)
         
     finally:
         # Orient back to normal
@@ -913,19 +612,39 @@ def get_model_string( ctxt ):
         for o in obj:
             RotateObj(o, 90, 'X')
     
-    return builder.Bytes, builder.Head()
-
+    return data
 
 # #####################################################
 # Main
 # #####################################################
+# Settings of one export and the armature it writes, handed down to every
+# mesh
+class ExportOptions():
+    __slots__ = ['Optimize', 'Quantization', 'Armature']
+
+    def __init__(self, optimize=False, quantization='FULL'):
+        self.Optimize = optimize
+        self.Quantization = quantization
+        self.Armature = None
+
 class ExportModel():
     def save( operator, context ):
         debug("Saving to " + operator.filepath)
+        options = ExportOptions(operator.optimize, operator.quantization)
         
-        bin, off = get_model_string( context )
-        f = open(operator.filepath, 'wb')
-        f.write(bin[off:])
-        f.close()
+        prof = None
+        if operator.profile:
+            prof = profiling.Profiler("export", cprofile=operator.profile_cprofile).Start()
+        try:
+            data = get_model_string( context, options )
+            with profiling.Phase("write"):
+                with open(operator.filepath, 'wb') as f:
+                    f.write(data)
+            profiling.Count("bytes_written", len(data))
+        finally:
+            if prof is not None:
+                prof.Stop()
+                print(prof.Summary())
+                prof.Write(operator.filepath)
         
         return {"FINISHED"}
\ No newline at end of file
@@ -0,0 +1,270 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Headless gfbmdl converter, needs only numpy and flatbuffers:
+#   python gfbmdl_convert.py model.gfbmdl -f glb -o out/
+#   python gfbmdl_convert.py models/ -f obj -o out/ -j 8
+
+import os
+import sys
+import json
+import struct
+import argparse
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+from Gfbmdl.VertexType import VertexType
+from model_data import DecodeModelFile, GetMeshNames
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON = 0x4E4F534A
+GLB_BIN = 0x004E4942
+
+GL_FLOAT = 5126
+GL_UNSIGNED_SHORT = 5123
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+# #####################################################
+# Utils
+# #####################################################
+def debug(str):
+    print(str)
+
+def Align4(size):
+    return (size + 3) & ~3
+
+def EulerToQuat(rot):
+    # XYZ euler in radians to (x, y, z, w)
+    cx, cy, cz = numpy.cos(numpy.asarray(rot, dtype=numpy.float64) * 0.5)
+    sx, sy, sz = numpy.sin(numpy.asarray(rot, dtype=numpy.float64) * 0.5)
+    return [
+        float(sx*cy*cz - cx*sy*sz),
+        float(cx*sy*cz + sx*cy*sz),
+        float(cx*cy*sz - sx*sy*cz),
+        float(cx*cy*cz + sx*sy*sz),
+    ]
+
+def GetAttrib(mesh, vtype, width, fill):
+    ret = numpy.full((mesh.VertexCount, width), fill, dtype=numpy.float32)
+    if vtype in mesh.Attributes:
+        values = mesh.Attributes[vtype]
+        cnt = min(width, values.shape[1])
+        ret[:, :cnt] = values[:, :cnt]
+    return ret
+
+def NormalizeRows(values):
+    length = numpy.linalg.norm(values, axis=1, keepdims=True)
+    length[length == 0.0] = 1.0
+    return (values / length).astype(numpy.float32)
+
+# #####################################################
+# glTF
+# #####################################################
+class GlbWriter():
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.views = []
+        self.accessors = []
+
+    def AddView(self, arr, target):
+        data = numpy.ascontiguousarray(arr)
+        self.views.append({"buffer": 0, "byteOffset": self.size, "byteLength": data.nbytes, "target": target})
+        self.chunks.append(data)
+        self.size = Align4(self.size + data.nbytes)
+        return len(self.views) - 1
+
+    def AddAccessor(self, arr, type, componentType, target, bounds=False):
+        accessor = {
+            "bufferView": self.AddView(arr, target),
+            "componentType": componentType,
+            "count": len(arr),
+            "type": type,
+        }
+        if bounds and len(arr) > 0:
+            accessor["min"] = arr.min(axis=0).tolist()
+            accessor["max"] = arr.max(axis=0).tolist()
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def Write(self, path, gltf):
+        if self.size > 0:
+            gltf["buffers"] = [{"byteLength": self.size}]
+            gltf["bufferViews"] = self.views
+            gltf["accessors"] = self.accessors
+        jsonData = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+        jsonData += b' ' * (Align4(len(jsonData)) - len(jsonData))
+        total = 12 + 8 + len(jsonData) + (8 + self.size if self.size > 0 else 0)
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<III', GLB_MAGIC, 2, total))
+            f.write(struct.pack('<II', len(jsonData), GLB_JSON))
+            f.write(jsonData)
+            if self.size == 0:
+                return
+            f.write(struct.pack('<II', self.size, GLB_BIN))
+            # Stream each array straight from its decoded buffer
+            for data in self.chunks:
+                f.write(memoryview(data).cast('B'))
+                f.write(b'\0' * (Align4(data.nbytes) - data.nbytes))
+
+def WriteGlb(data, path):
+    glb = GlbWriter()
+    gltf = {"asset": {"version": "2.0", "generator": "gfbmdl_convert"}, "scene": 0}
+    gltf["materials"] = [{"name": m.Name} for m in data.Materials]
+    nodes = []
+    roots = []
+
+    # Skeleton
+    for i, name in enumerate(data.BoneNames):
+        nodes.append({
+            "name": name,
+            "translation": data.BoneTranslations[i].tolist(),
+            "rotation": EulerToQuat(data.BoneRotations[i]),
+            "scale": data.BoneScales[i].tolist(),
+        })
+    for i, parent in enumerate(data.BoneParents):
+        if 0 <= parent < len(nodes) and parent != i:
+            nodes[parent].setdefault("children", []).append(i)
+        else:
+            roots.append(i)
+
+    # Meshes
+    meshes = []
+    for name, mesh in zip(GetMeshNames(data), data.Meshes):
+        # glTF has no empty accessors, so leave out meshes without vertices
+        # and groups without a whole triangle
+        polys = [(matIdx, faces[:len(faces) // 3 * 3]) for matIdx, faces in mesh.Polygons]
+        polys = [(matIdx, faces) for matIdx, faces in polys if len(faces) > 0]
+        if mesh.VertexCount == 0 or len(polys) == 0:
+            continue
+        attribs = {
+            "POSITION": glb.AddAccessor(GetAttrib(mesh, VertexType.Position, 3, 0.0), "VEC3", GL_FLOAT, GL_ARRAY_BUFFER, True),
+        }
+        if VertexType.Normal in mesh.Attributes:
+            attribs["NORMAL"] = glb.AddAccessor(NormalizeRows(GetAttrib(mesh, VertexType.Normal, 3, 0.0)), "VEC3", GL_FLOAT, GL_ARRAY_BUFFER)
+        if VertexType.UV1 in mesh.Attributes:
+            attribs["TEXCOORD_0"] = glb.AddAccessor(GetAttrib(mesh, VertexType.UV1, 2, 0.0), "VEC2", GL_FLOAT, GL_ARRAY_BUFFER)
+        if VertexType.Color1 in mesh.Attributes:
+            attribs["COLOR_0"] = glb.AddAccessor(GetAttrib(mesh, VertexType.Color1, 4, 1.0), "VEC4", GL_FLOAT, GL_ARRAY_BUFFER)
+        prims = []
+        for matIdx, faces in polys:
+            prim = {"attributes": attribs, "indices": glb.AddAccessor(faces, "SCALAR", GL_UNSIGNED_SHORT, GL_ELEMENT_ARRAY_BUFFER)}
+            if matIdx < len(data.Materials):
+                prim["material"] = int(matIdx)
+            prims.append(prim)
+        meshes.append({"name": name, "primitives": prims})
+        nodes.append({"name": name, "mesh": len(meshes) - 1})
+        roots.append(len(nodes) - 1)
+
+    gltf["meshes"] = meshes
+    gltf["nodes"] = nodes
+    gltf["scenes"] = [{"nodes": roots}]
+    # glTF arrays may not be empty
+    for key in ("materials", "meshes", "nodes"):
+        if len(gltf[key]) == 0:
+            del gltf[key]
+    if len(roots) == 0:
+        del gltf["scenes"][0]["nodes"]
+    glb.Write(path, gltf)
+
+# #####################################################
+# OBJ
+# #####################################################
+def WriteObj(data, path):
+    mtlPath = os.path.splitext(path)[0] + ".mtl"
+    with open(mtlPath, 'w') as f:
+        for mat in data.Materials:
+            f.write("newmtl %s\n" % mat.Name)
+
+    with open(path, 'w') as f:
+        f.write("# gfbmdl_convert\n")
+        f.write("mtllib %s\n" % os.path.basename(mtlPath))
+        # OBJ has no skeletons, keep the hierarchy as comments
+        for i, name in enumerate(data.BoneNames):
+            f.write("# bone %d %s parent %d\n" % (i, name, data.BoneParents[i]))
+
+        base = 1
+        for name, mesh in zip(GetMeshNames(data), data.Meshes):
+            f.write("o %s\n" % name)
+            numpy.savetxt(f, GetAttrib(mesh, VertexType.Position, 3, 0.0), fmt="v %.6f %.6f %.6f")
+            numpy.savetxt(f, GetAttrib(mesh, VertexType.UV1, 2, 0.0), fmt="vt %.6f %.6f")
+            numpy.savetxt(f, NormalizeRows(GetAttrib(mesh, VertexType.Normal, 3, 0.0)), fmt="vn %.6f %.6f %.6f")
+            for matIdx, faces in mesh.Polygons:
+                if matIdx < len(data.Materials):
+                    f.write("usemtl %s\n" % data.Materials[matIdx].Name)
+                tris = faces[:len(faces) // 3 * 3].astype(numpy.int64).reshape(-1, 3) + base
+                numpy.savetxt(f, numpy.repeat(tris, 3, axis=1), fmt="f %d/%d/%d %d/%d/%d %d/%d/%d")
+            base += mesh.VertexCount
+
+# #####################################################
+# Main
+# #####################################################
+Writers = {
+    "glb": WriteGlb,
+    "obj": WriteObj,
+}
+
+def ConvertFile(args):
+    path, outDir, format = args
+    name = os.path.splitext(os.path.basename(path))[0]
+    out = os.path.join(outDir or os.path.dirname(path), name + "." + format)
+    Writers[format](DecodeModelFile(path), out)
+    return out
+
+def CollectFiles(inputs):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(".gfbmdl"))
+        else:
+            files.append(path)
+    return files
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert gfbmdl models to glTF binary or OBJ without Blender.")
+    parser.add_argument("inputs", nargs="+", help=".gfbmdl files or directories to convert")
+    parser.add_argument("-f", "--format", choices=sorted(Writers), default="glb", help="output format")
+    parser.add_argument("-o", "--output", help="output directory (defaults to next to each input)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    files = CollectFiles(args.inputs)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    tasks = [(f, args.output, args.format) for f in files]
+
+    failed = 0
+    if args.jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(ConvertFile, t) for t in tasks]
+            for task, future in zip(tasks, futures):
+                try:
+                    debug(future.result())
+                except Exception as e:
+                    debug("Failed %s: %s" % (task[0], e))
+                    failed += 1
+    else:
+        for task in tasks:
+            try:
+                debug(ConvertFile(task))
+            except Exception as e:
+                debug("Failed %s: %s" % (task[0], e))
+                failed += 1
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
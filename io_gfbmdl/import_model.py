@@ -23,6 +23,7 @@ import sys
 import math
 import operator
 import numpy
+import multiprocessing
 import struct
 import bmesh
 from enum import IntEnum
@@ -48,6 +49,11 @@ import Gfbmdl.TextureMap
 import Gfbmdl.TextureMapping
 import Gfbmdl.CollisionGroup
 import Gfbmdl.Vector3
+from Gfbmdl.VertexType import VertexType
+from model_data import DecodeModels, GetMeshNames
+from skinning import GroupInfluences
+from skeleton import ComposeMatrices, CleanParents, SolveWorldMatrices
+import profiling
 
 class BufferFormat(IntEnum):
     Float = 0
@@ -68,26 +74,12 @@ class BoneType(IntEnum):
 # #####################################################
 # Utils
 # #####################################################
-def CalcStride(type, cnt):
-    ret = 0
-    if type == BufferFormat.Float:
-        ret = 4 * cnt
-    if type == BufferFormat.HalfFloat:
-        ret = 2 * cnt
-    if type == BufferFormat.Byte:
-        ret = cnt
-    if type == BufferFormat.Short:
-        ret = 2 * cnt
-    if type == BufferFormat.BytesAsFloat:
-        ret = 1 * cnt
+def FitColumns(arr, width, fill):
+    ret = numpy.full((len(arr), width), fill, dtype=numpy.float32)
+    cnt = min(width, arr.shape[1])
+    ret[:, :cnt] = arr[:, :cnt]
     return ret
     
-def GetMatValue(mat, param):
-    for v in range(mat.ValuesLength()):
-        if mat.Values(v).Name().decode('utf-8') == param:
-            return mat.Values(v).Value()
-    return None
-    
 def RotateObj(obj, angle, axis):
     rot_mat = Matrix.Rotation(radians(angle), 4, axis)
 
@@ -101,45 +93,70 @@ def RotateObj(obj, angle, axis):
 # #####################################################
 # Model
 # #####################################################
-def BuildArmature(mon):
+class ImportContext():
+    def __init__(self, data):
+        self.data = data
+        self.armature = None
+        self.materials = []
+        self.objects = []
+
+def BuildArmature(ctx):
+    data = ctx.data
     armature = bpy.data.armatures.new("Armature")
     obj = bpy.data.objects.new(armature.name, armature)            
     bpy.context.collection.objects.link(obj)
     obj.select_set(True)
     bpy.context.view_layer.objects.active = obj
+    ctx.armature = obj
+    ctx.objects.append(obj)
     
-    boneLen = mon.BonesLength()
+    boneLen = len(data.BoneNames)
     print("Total bones: %d" % boneLen)
+    
+    # Solve every bone's armature space matrix in one go
+    local = ComposeMatrices(data.BoneTranslations, data.BoneRotations, data.BoneScales)
+    parents = CleanParents(data.BoneParents)
+    world = SolveWorldMatrices(local, parents)
+    heads = world[:, :3, 3]
+    
+    # Bones point at their first child, leaf bones keep their parent's length
+    lengths = numpy.full(boneLen, 0.1)
+    children = numpy.flatnonzero(parents >= 0)
+    dist = numpy.linalg.norm(heads[children] - heads[parents[children]], axis=1)
+    for child, d in zip(children[::-1], dist[::-1]):
+        if d > 1e-4:
+            lengths[parents[child]] = d
+    for i in numpy.flatnonzero(numpy.bincount(parents[children], minlength=boneLen) == 0):
+        if parents[i] >= 0:
+            lengths[i] = lengths[parents[i]]
+    
+    # Edit bone matrices carry no scale
+    basis = world[:, :3, :3]
+    norms = numpy.linalg.norm(basis, axis=1)
+    world[:, :3, :3] = basis / numpy.where(norms == 0.0, 1.0, norms)[:, None, :]
+    
     bpy.ops.object.mode_set(mode='EDIT')
-    global_matrix = (Matrix.Scale(1, 4))
+    editBones = []
     for i in range(boneLen):
-        bone = mon.Bones(i)
-        bname = bone.Name().decode("utf-8")
-        btype = bone.BoneType()
-        transVec = bone.Translation()
-        rotVec = bone.Rotation()
-        parent = bone.Parent()
-        vis = bone.Visible()
-        eb = armature.edit_bones.new(bname)
-        eb.head = (transVec.X(),transVec.Y(),transVec.Z())
+        eb = armature.edit_bones.new(data.BoneNames[i])
+        eb.head = (0.0, 0.0, 0.0)
+        eb.tail = (0.0, float(lengths[i]), 0.0)
         eb.use_inherit_rotation = True
-        if btype == BoneType.HasSkinning:
-            eb.use_deform = True
-        if parent >= 0:
-            eb.parent = bpy.data.armatures[armature.name].edit_bones[parent]
-            eb.tail = eb.parent.head
-            eb.matrix = eb.parent.matrix @ global_matrix
-        else:
-            eb.tail = (0,0,1)
-            eb.matrix = global_matrix
-        eb.use_connect = True
+        eb.use_deform = bool(data.BoneTypes[i] == BoneType.HasSkinning)
+        eb.matrix = Matrix(world[i].tolist())
+        editBones.append(eb)
+    for i in children:
+        editBones[i].parent = editBones[parents[i]]
         
     bpy.ops.object.mode_set(mode='OBJECT')
     bpy.ops.object.select_all(action='DESELECT')
 
 def CreateMaterial(material):
-    mat = bpy.data.materials.new(name=material.Name().decode("utf-8"))
+    mat = bpy.data.materials.new(name=material.Name)
     mat.use_nodes = True
+    # Exported again with the matching shader preset
+    if material.ShaderGroup:
+        mat["ShaderGroup"] = material.ShaderGroup
     nodes = mat.node_tree.nodes
     links = mat.node_tree.links
     shdr = nodes.get('Principled BSDF')
@@ -156,129 +173,139 @@ def CreateMaterial(material):
     links.new(mix.outputs[0], shdr.inputs[0]) # mix -> shader
     return mat
 
-def CreateMesh(name, mon, ind, mats):        
-    attribType = []
-    alignStride = []
-    totalStride = 0
-    mesh = mon.Meshes(ind)
-    for t in range(mesh.AttributesLength()):
-        attrib = mesh.Attributes(t)
-        attribType.append(attrib.VertexType())
-        stride = int(CalcStride(attrib.BufferFormat(), attrib.ElementCount()))
-        alignStride.append(stride)
-        totalStride += stride
+def CreateMesh(ctx, name, mesh):        
+    print("Total verts (%s): %d" % (name, mesh.VertexCount))
     
-
-    rawData = mesh.DataAsNumpy()
-    print("Total bytes (%s): %d" % (name, len(rawData)))
-    print("Total stride (%s): %d" % (name, totalStride))
+    attribs = mesh.Attributes
+    vertCnt = mesh.VertexCount
+    pos = attribs.get(VertexType.Position, numpy.zeros((vertCnt, 3), dtype=numpy.float32))
+    norm = attribs.get(VertexType.Normal, numpy.zeros((vertCnt, 3), dtype=numpy.float32))
+    uv_map = attribs.get(VertexType.UV1, numpy.zeros((vertCnt, 2), dtype=numpy.float32))
+    cols = attribs.get(VertexType.Color1, numpy.ones((vertCnt, 4), dtype=numpy.float32))
+    bids = attribs.get(VertexType.BoneID)
+    weights = attribs.get(VertexType.BoneWeight)
     
-    nmesh = bpy.data.meshes.new(name)
+    # Gather triangles and their per-loop material data from every polygon group
+    faces = []
+    faceMats = []
+    loopScales = []
+    for matIdx, pdata in mesh.Polygons:
+        mat = ctx.data.Materials[matIdx]
+        triCnt = len(pdata) // 3
+        scaleU = mat.Value("ColorUVScaleU", 1.0)
+        scaleV = mat.Value("ColorUVScaleV", 1.0)
+        faces.append(pdata[:triCnt*3])
+        faceMats.append(numpy.full(triCnt, matIdx, dtype=numpy.int32))
+        loopScales.append(numpy.tile(numpy.array([scaleU, scaleV], dtype=numpy.float32), (triCnt*3, 1)))
+    loopVerts = numpy.concatenate(faces).astype(numpy.int32) if faces else numpy.zeros(0, dtype=numpy.int32)
+    faceMats = numpy.concatenate(faceMats) if faceMats else numpy.zeros(0, dtype=numpy.int32)
+    loopScales = numpy.concatenate(loopScales) if loopScales else numpy.zeros((0, 2), dtype=numpy.float32)
+    triCnt = len(faceMats)
     
-    # Create new bmesh
-    bm = bmesh.new()
-    bm.from_mesh(nmesh)
+    profiling.Count("vertices", vertCnt)
+    profiling.Count("triangles", triCnt)
     
-    # Parse raw buffer
-    uv_map = []
-    cols = []
-    bids = []
-    weights = []
-    vc = bm.loops.layers.color.new("Color")
-    uv = bm.loops.layers.uv.new("UVMap")
-    boneCnt = len(bpy.data.armatures[0].bones)
-    for v in range(int(len(rawData)/totalStride)):
-        baseOff = int(v*totalStride)
-        [posx,posy,posz] = struct.unpack_from('3f', rawData, baseOff)
-        [normx,normy,normz,normw] = struct.unpack_from('4e', rawData, baseOff+12)
-        [bnormx,bnormy,bnormz,bnormw] = struct.unpack_from('4e', rawData, baseOff+20)
-        [u_coord, v_coord] = struct.unpack_from('2f', rawData, baseOff+28)
-        [r1, g1, b1, a1, r2, g2, b2, a2] = struct.unpack_from('4B4B', rawData, baseOff+36)
-        [boneId0, boneId1, boneId2, boneId3, boneWeight] = struct.unpack_from('4Bf', rawData, baseOff+44)
-        vert = bm.verts.new((posx,posy,posz))
-        vert.normal = ((normx,normy,normz))
-        uv_map.append((u_coord,v_coord))
-        cols.append((r1/255.0, g1/255.0, b1/255.0, a1/255.0))
-        bids.append((boneId0, boneId1, boneId2, boneId3))
-        weights.append(boneWeight)
-        bm.verts.index_update()
+    # Build geometry straight from the decoded arrays
+    with profiling.Phase("face build"):
+        nmesh = bpy.data.meshes.new(name)
+        nmesh.vertices.add(vertCnt)
+        nmesh.vertices.foreach_set("co", FitColumns(pos, 3, 0.0).ravel())
+        nmesh.loops.add(len(loopVerts))
+        nmesh.loops.foreach_set("vertex_index", loopVerts)
+        nmesh.polygons.add(triCnt)
+        nmesh.polygons.foreach_set("loop_start", numpy.arange(0, triCnt*3, 3, dtype=numpy.int32))
+        nmesh.polygons.foreach_set("loop_total", numpy.full(triCnt, 3, dtype=numpy.int32))
+        nmesh.polygons.foreach_set("material_index", faceMats)
     
-    # Iterate through polygons
-    for poly in range(mesh.PolygonsLength()):
-        polygon = mesh.Polygons(poly)
-        matIdx = polygon.MaterialIndex()
-        pdata = polygon.FacesAsNumpy()
-        bm.verts.ensure_lookup_table()
-        mat = mon.Materials(matIdx)
-        d=0
-        bm.faces.ensure_lookup_table()
-        # Set faces and cooresponding material ids
-        while d < int(len(pdata)-2):
-            face = bm.faces.new((bm.verts[pdata[d]], bm.verts[pdata[d+1]], bm.verts[pdata[d+2]]))
-            face.material_index = matIdx
-            face.normal_update()
-            d+=3
-            
-        # Set vertex colors and uvs
-        for face in bm.faces:
-            for loop in face.loops:
-                loop[vc] = cols[loop.vert.index]
-                loop[uv].uv[0] = uv_map[loop.vert.index][0] * GetMatValue(mat, "ColorUVScaleU")
-                loop[uv].uv[1] = uv_map[loop.vert.index][1] * GetMatValue(mat, "ColorUVScaleV")
-          
-    # Assign bmesh to new created mesh
-    bm.to_mesh(nmesh)
-    bm.free()
+        # Set vertex colors and uvs, one assignment per layer
+        uv = nmesh.uv_layers.new(name="UVMap")
+        uv.data.foreach_set("uv", (FitColumns(uv_map, 2, 0.0)[loopVerts] * loopScales).ravel())
+        vc = nmesh.vertex_colors.new(name="Color")
+        vc.data.foreach_set("color", FitColumns(cols, 4, 1.0)[loopVerts].ravel())
+    
+        nmesh.update(calc_edges=True)
+        nmesh.validate(clean_customdata=False)
+        nmesh.use_auto_smooth = True
+        nmesh.normals_split_custom_set_from_vertices(FitColumns(norm, 3, 0.0))
     
     # Link mesh to object in scene
     obj = bpy.data.objects.new(nmesh.name, nmesh)
     bpy.context.collection.objects.link(obj)
+    ctx.objects.append(obj)
     
-    # Set vertex groups
-    for b in bpy.data.armatures[0].bones:
-        # Get or create v-group
-        vg = obj.vertex_groups.get(b.name)
-        if vg is None: 
-            vg = obj.vertex_groups.new(name=b.name)
-        #vg.add(tmp, 1.0, 'ADD')
+    # Set vertex groups, one assignment per bone and weight
+    if bids is not None and weights is not None:
+        with profiling.Phase("skin weights"):
+            for bone, weight, verts in GroupInfluences(bids, weights):
+                if bone >= len(ctx.data.BoneNames):
+                    continue
+                name = ctx.data.BoneNames[bone]
+                vg = obj.vertex_groups.get(name)
+                if vg is None:
+                    vg = obj.vertex_groups.new(name=name)
+                vg.add(verts.tolist(), weight, 'REPLACE')
+        mod = obj.modifiers.new(name="Armature", type='ARMATURE')
+        mod.object = ctx.armature
     
     # Assign all materials to each mesh (maybe do this smarter later?)
-    for mt in mats:
+    for mt in ctx.materials:
         obj.data.materials.append(mt)
         
-def LoadModel(buf):
-    mon = Gfbmdl.Model.Model.GetRootAsModel(buf, 0)
+def LoadModel(data):
+    ctx = ImportContext(data)
     
     # Create armature
-    BuildArmature(mon)
+    with profiling.Phase("armature"):
+        BuildArmature(ctx)
     
     # Create materials
-    mats = []
-    matLen = mon.MaterialsLength()
-    for i in range(matLen):
-        mats.append(CreateMaterial(mon.Materials(i)))
+    with profiling.Phase("materials"):
+        for mat in data.Materials:
+            ctx.materials.append(CreateMaterial(mat))
     
     # Create meshes
-    for i in range(mon.MeshesLength()):
-        CreateMesh(bpy.data.armatures[0].bones[mon.Groups(i).BoneIndex()].name, mon, i, mats) #TODO: dont assume groups are in order by matIndex
+    with profiling.Phase("meshes"):
+        for name, mesh in zip(GetMeshNames(data), data.Meshes):
+            CreateMesh(ctx, name, mesh)
 
     # Orient properly
-    obj = [o for o in bpy.context.scene.objects if o.type == 'MESH' or o.type == 'ARMATURE']
-    for o in obj:
+    for o in ctx.objects:
         RotateObj(o, 90, 'X')
+    return ctx
     
 # #####################################################
 # Main
 # #####################################################
 class ImportModel():
     def load( operator, context ):
-        for f in enumerate(operator.files):
-            fpath = operator.directory + f[1].name
-            print("Loading " + fpath)
-            
-            buf = open(fpath, 'rb').read()
-            buf = bytearray(buf)
-            LoadModel(buf)
-            bpy.ops.object.delete()
+        paths = [os.path.join(operator.directory, f.name) for f in operator.files]
+        if len(paths) == 0:
+            paths = [operator.filepath]
+        
+        # Blender < 2.91 reports itself as the python executable
+        if hasattr(bpy.app, "binary_path_python"):
+            multiprocessing.set_executable(bpy.app.binary_path_python)
+        
+        prof = None
+        if operator.profile:
+            prof = profiling.Profiler("import", cprofile=operator.profile_cprofile).Start()
+        try:
+            models = DecodeModels(paths, operator.jobs)
+            while True:
+                with profiling.Phase("decode"):
+                    item = next(models, None)
+                if item is None:
+                    break
+                fpath, data = item
+                print("Loading " + fpath)
+                with profiling.Phase("build"):
+                    LoadModel(data)
+                    bpy.ops.object.delete()
+                profiling.Count("files")
+        finally:
+            if prof is not None:
+                prof.Stop()
+                print(prof.Summary())
+                prof.Write(os.path.splitext(paths[0])[0] + ".import")
             
-            return {"FINISHED"}
\ No newline at end of file
+        return {"FINISHED"}
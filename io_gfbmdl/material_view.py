@@ -0,0 +1,106 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+def DecodeName(name):
+    if name is None:
+        return ""
+    return name.decode('utf-8')
+
+def ReadParams(length, get, read):
+    params = {}
+    for i in range(length):
+        entry = get(i)
+        params[DecodeName(entry.Name())] = read(entry)
+    return params
+
+def ReadColor(entry):
+    col = entry.Color()
+    if col is None:
+        return (0.0, 0.0, 0.0)
+    return (col.R(), col.G(), col.B())
+
+# #####################################################
+# Views
+# #####################################################
+class TextureMapView():
+    __slots__ = ['Sampler', 'Index', 'WrapModeX', 'WrapModeY', 'WrapModeZ', 'LodBias']
+
+    def __init__(self, texMap):
+        self.Sampler = DecodeName(texMap.Sampler())
+        self.Index = texMap.Index()
+        params = texMap.Params()
+        if params is not None:
+            self.WrapModeX = params.WrapModeX()
+            self.WrapModeY = params.WrapModeY()
+            self.WrapModeZ = params.WrapModeZ()
+            self.LodBias = params.LodBias()
+        else:
+            self.WrapModeX = self.WrapModeY = self.WrapModeZ = 0
+            self.LodBias = 0.0
+
+class MaterialCommonView():
+    __slots__ = ['Switches', 'Values', 'Colors']
+
+    def __init__(self, common):
+        self.Switches = {}
+        self.Values = {}
+        self.Colors = {}
+        if common is None:
+            return
+        self.Switches = ReadParams(common.SwitchesLength(), common.Switches, lambda e: e.Value())
+        self.Values = ReadParams(common.ValuesLength(), common.Values, lambda e: e.Value())
+        self.Colors = ReadParams(common.ColorsLength(), common.Colors, ReadColor)
+
+class MaterialView():
+    __slots__ = ['Name', 'ShaderGroup', 'Values', 'Switches', 'Colors', 'TextureMaps', 'Common']
+
+    def __init__(self, material):
+        self.Name = DecodeName(material.Name())
+        self.ShaderGroup = DecodeName(material.ShaderGroup())
+        self.Values = ReadParams(material.ValuesLength(), material.Values, lambda e: e.Value())
+        self.Switches = ReadParams(material.SwitchesLength(), material.Switches, lambda e: e.Value())
+        self.Colors = ReadParams(material.ColorsLength(), material.Colors, ReadColor)
+        self.TextureMaps = {}
+        for i in range(material.TextureMapsLength()):
+            tex = TextureMapView(material.TextureMaps(i))
+            self.TextureMaps[tex.Sampler] = tex
+        self.Common = MaterialCommonView(material.Common())
+
+    def Value(self, name, default=None):
+        return self.Values.get(name, default)
+
+    def Switch(self, name, default=None):
+        return self.Switches.get(name, default)
+
+    def Color(self, name, default=None):
+        return self.Colors.get(name, default)
+
+    def TextureMap(self, name):
+        return self.TextureMaps.get(name)
+
+# Decodes each material of a model once, on first use
+class MaterialCache():
+    def __init__(self, model):
+        self.model = model
+        self.views = {}
+
+    def __len__(self):
+        return self.model.MaterialsLength()
+
+    def Get(self, index):
+        view = self.views.get(index)
+        if view is None:
+            view = MaterialView(self.model.Materials(index))
+            self.views[index] = view
+        return view
@@ -0,0 +1,195 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Index and vertex ordering for the GPU: vertex cache order (Tom Forsyth's
+# linear-speed algorithm), overdraw cluster sort and first-use vertex order.
+
+import numpy
+
+CACHE_SIZE = 32
+CACHE_DECAY_POWER = 1.5
+LAST_TRI_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+# Size of the FIFO cache used for the statistics
+STATS_CACHE_SIZE = 16
+
+# #####################################################
+# Statistics
+# #####################################################
+def CacheMisses(faces, cacheSize=STATS_CACHE_SIZE):
+    stamps = {}
+    time = 0
+    misses = 0
+    for v in numpy.asarray(faces).ravel().tolist():
+        if time - stamps.get(v, -cacheSize) >= cacheSize:
+            stamps[v] = time
+            time += 1
+            misses += 1
+    return misses
+
+# Average cache miss ratio (misses per triangle, 0.5 is ideal) and average
+# transformed vertex ratio (misses per vertex, 1.0 is ideal)
+def CacheStats(faces, cacheSize=STATS_CACHE_SIZE):
+    faces = numpy.asarray(faces).reshape(-1, 3)
+    if len(faces) == 0:
+        return 0.0, 0.0
+    misses = CacheMisses(faces, cacheSize)
+    return misses / len(faces), misses / len(numpy.unique(faces))
+
+# #####################################################
+# Vertex cache order
+# #####################################################
+CacheScores = [LAST_TRI_SCORE] * 3 + [(1.0 - (i - 3) / (CACHE_SIZE - 3)) ** CACHE_DECAY_POWER for i in range(3, CACHE_SIZE)]
+
+def ValenceScores(maxValence):
+    counts = numpy.maximum(numpy.arange(maxValence + 1), 1)
+    return (VALENCE_BOOST_SCALE * counts ** -VALENCE_BOOST_POWER).tolist()
+
+def OptimizeVertexCache(faces):
+    faces = numpy.asarray(faces).reshape(-1, 3)
+    triCnt = len(faces)
+    if triCnt == 0:
+        return faces.copy()
+    vertCnt = int(faces.max()) + 1
+
+    # Triangles of every vertex, CSR style
+    flat = faces.ravel()
+    order = numpy.argsort(flat, kind='stable')
+    valence = numpy.bincount(flat, minlength=vertCnt)
+    starts = numpy.concatenate(([0], numpy.cumsum(valence)))
+    vertTris = (order // 3).tolist()
+    starts = starts.tolist()
+    live = valence.tolist()
+    valenceScore = ValenceScores(int(valence.max()))
+
+    vertScore = [valenceScore[n] for n in live]
+    triVerts = faces.tolist()
+    triScore = numpy.asarray(vertScore)[faces].sum(axis=1).tolist()
+    emitted = [False] * triCnt
+
+    out = []
+    cache = []
+    best = max(range(triCnt), key=triScore.__getitem__)
+    nextFree = 0
+    while True:
+        tri = triVerts[best]
+        out.append(best)
+        emitted[best] = True
+
+        # Retire the triangle from its vertices
+        for v in tri:
+            s = starts[v]
+            n = live[v]
+            for i in range(s, s + n):
+                if vertTris[i] == best:
+                    vertTris[i], vertTris[s + n - 1] = vertTris[s + n - 1], vertTris[i]
+                    break
+            live[v] = n - 1
+
+        # LRU update, the new triangle's vertices go to the front
+        newCache = list(tri)
+        for v in cache:
+            if v != tri[0] and v != tri[1] and v != tri[2]:
+                newCache.append(v)
+        cache = newCache
+
+        # Rescore touched vertices and their remaining triangles
+        best = -1
+        bestScore = -1.0
+        for i, v in enumerate(cache):
+            n = live[v]
+            if n == 0:
+                score = -1.0
+            elif i < CACHE_SIZE:
+                score = CacheScores[i] + valenceScore[n]
+            else:
+                score = valenceScore[n]
+            delta = score - vertScore[v]
+            vertScore[v] = score
+            s = starts[v]
+            for t in vertTris[s:s + n]:
+                triScore[t] += delta
+                if triScore[t] > bestScore:
+                    bestScore = triScore[t]
+                    best = t
+        del cache[CACHE_SIZE:]
+
+        if len(out) == triCnt:
+            break
+        if best < 0:
+            # Dead end, continue from the first triangle not yet written
+            while emitted[nextFree]:
+                nextFree += 1
+            best = nextFree
+    return faces[numpy.array(out)]
+
+# #####################################################
+# Overdraw
+# #####################################################
+# Cuts the cache ordered list where a triangle misses on all three vertices
+# and sorts those clusters so outward facing ones are drawn first. Clusters
+# stay intact, so the cache order inside them is kept. The first cluster
+# always starts at triangle 0, even if that one is degenerate.
+def OptimizeOverdraw(faces, positions, cacheSize=STATS_CACHE_SIZE):
+    faces = numpy.asarray(faces).reshape(-1, 3)
+    if len(faces) < 2:
+        return faces.copy()
+    stamps = {}
+    time = 0
+    starts = [0]
+    for t, tri in enumerate(faces.tolist()):
+        misses = 0
+        for v in tri:
+            if time - stamps.get(v, -cacheSize) >= cacheSize:
+                stamps[v] = time
+                time += 1
+                misses += 1
+        if misses == 3 and t > 0:
+            starts.append(t)
+    if len(starts) < 2:
+        return faces.copy()
+
+    pos = numpy.asarray(positions, dtype=numpy.float64)[faces]
+    normals = numpy.cross(pos[:, 1] - pos[:, 0], pos[:, 2] - pos[:, 0])
+    area = numpy.linalg.norm(normals, axis=1)
+    centers = pos.mean(axis=1)
+    cluster = numpy.cumsum(numpy.isin(numpy.arange(len(faces)), starts)) - 1
+    clusterCnt = len(starts)
+
+    weight = numpy.maximum(numpy.bincount(cluster, weights=area, minlength=clusterCnt), 1e-12)
+    center = numpy.stack([numpy.bincount(cluster, weights=centers[:, i] * area, minlength=clusterCnt) for i in range(3)], axis=1) / weight[:, None]
+    normal = numpy.stack([numpy.bincount(cluster, weights=normals[:, i], minlength=clusterCnt) for i in range(3)], axis=1)
+    normal /= numpy.maximum(numpy.linalg.norm(normal, axis=1), 1e-12)[:, None]
+    meshCenter = (centers * area[:, None]).sum(axis=0) / max(area.sum(), 1e-12)
+
+    key = ((center - meshCenter) * normal).sum(axis=1)
+    clusterOrder = numpy.argsort(-key, kind='stable')
+    return faces[numpy.argsort(numpy.argsort(clusterOrder)[cluster], kind='stable')]
+
+# #####################################################
+# Vertex fetch
+# #####################################################
+# New order of the vertices in first-use order, unused vertices go last.
+# Returns (order, remap) with new = remap[old] and old = order[new].
+def OptimizeVertexFetch(faces, vertCnt):
+    flat = numpy.asarray(faces).ravel()
+    uniq, first = numpy.unique(flat, return_index=True)
+    used = uniq[numpy.argsort(first)]
+    unused = numpy.setdiff1d(numpy.arange(vertCnt), used)
+    order = numpy.concatenate((used, unused)).astype(numpy.int64)
+    remap = numpy.empty(vertCnt, dtype=numpy.int64)
+    remap[order] = numpy.arange(vertCnt)
+    return order, remap
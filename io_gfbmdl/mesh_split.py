@@ -0,0 +1,65 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+# Faces are stored as uint16, so a mesh can address this many vertices
+MAX_VERTICES = 65535
+
+class MeshChunk():
+    __slots__ = ['Vertices', 'Faces', 'Materials']
+
+    def __init__(self, vertices, faces, materials):
+        # Source vertex of every local vertex, in first-use order
+        self.Vertices = vertices
+        # (triCnt, 3) local vertex indices and the material of each triangle
+        self.Faces = faces
+        self.Materials = materials
+
+# Local re-indexing of a run of triangles
+def MakeChunk(faces, materials):
+    flat = faces.ravel()
+    uniq, first, inverse = numpy.unique(flat, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    remap = numpy.empty_like(order)
+    remap[order] = numpy.arange(len(order))
+    return MeshChunk(uniq[order], remap[inverse.ravel()].reshape(-1, 3), materials)
+
+# Number of leading triangles whose vertices fit in `limit`
+def FittingTriangles(faces, limit):
+    window = max(limit, 1)
+    while True:
+        part = faces[:window]
+        _, first = numpy.unique(part.ravel(), return_index=True)
+        newVerts = numpy.bincount(first // 3, minlength=len(part))
+        fit = int(numpy.searchsorted(numpy.cumsum(newVerts), limit, side='right'))
+        if fit < len(part) or window >= len(faces):
+            return fit
+        window *= 2
+
+# Greedily cuts the triangle list into runs that each stay within `limit`
+# vertices. Triangles keep their order, so neighbouring triangles stay in
+# the same chunk and only vertices on the cuts get duplicated.
+def SplitTriangles(faces, materials, limit=MAX_VERTICES):
+    faces = numpy.asarray(faces).reshape(-1, 3)
+    materials = numpy.asarray(materials)
+    chunks = []
+    start = 0
+    while start < len(faces) or len(chunks) == 0:
+        fit = FittingTriangles(faces[start:], limit) if start < len(faces) else 0
+        if fit == 0 and start < len(faces):
+            raise ValueError("A triangle needs more than %d vertices" % limit)
+        chunks.append(MakeChunk(faces[start:start + fit], materials[start:start + fit]))
+        start += fit
+    return chunks
@@ -0,0 +1,90 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import numpy
+import flatbuffers
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+import profiling
+
+# Worst case padding StartVector can add: alignment plus the length prefix
+VECTOR_PADDING = 16
+
+class ModelBuilder(flatbuffers.Builder):
+    __slots__ = ('strings', 'objects')
+
+    def __init__(self, initialSize):
+        flatbuffers.Builder.__init__(self, initialSize)
+        self.strings = {}
+        self.objects = {}
+
+    # Every string is written once, later calls return the first offset
+    def CreateSharedString(self, s, encoding='utf-8', errors='strict'):
+        off = self.strings.get(s)
+        if off is None:
+            profiling.Count("strings_written")
+            off = self.CreateString(s, encoding, errors)
+            self.strings[s] = off
+        else:
+            profiling.Count("strings_shared")
+        return off
+
+    def growByteBuffer(self):
+        profiling.Count("builder_grow_events")
+        flatbuffers.Builder.growByteBuffer(self)
+
+    # Tables and vectors with the same content are written once. `key` must
+    # describe everything create(builder, *args) writes.
+    def CreateShared(self, key, create, *args):
+        off = self.objects.get(key)
+        if off is None:
+            profiling.Count("objects_written")
+            off = create(self, *args)
+            self.objects[key] = off
+        else:
+            profiling.Count("objects_shared")
+        return off
+
+    # Grow the buffer once so `size` more bytes fit without further reallocation
+    def Reserve(self, size):
+        if self.Head() >= size:
+            return
+        profiling.Count("builder_grow_events")
+        oldSize = len(self.Bytes)
+        newSize = oldSize + size - self.Head()
+        if newSize > flatbuffers.Builder.MAX_BUFFER_SIZE:
+            raise flatbuffers.builder.BuilderSizeError("flatbuffers: cannot grow buffer beyond 2 gigabytes")
+        bytes2 = bytearray(newSize)
+        bytes2[newSize-oldSize:] = self.Bytes
+        self.Bytes = bytes2
+        self.head = flatbuffers.number_types.UOffsetTFlags.py_type(self.Head() + newSize - oldSize)
+
+    # Copy a contiguous array or bytes object into a vector with a single memmove
+    def CreateBulkVector(self, data, elemSize, alignment):
+        if isinstance(data, numpy.ndarray):
+            if data.dtype.byteorder == '>':
+                data = data.astype(data.dtype.newbyteorder('<'))
+            raw = memoryview(numpy.ascontiguousarray(data)).cast('B')
+        else:
+            raw = memoryview(data).cast('B')
+        size = len(raw)
+        count = size // elemSize
+
+        self.Reserve(size + VECTOR_PADDING)
+        self.StartVector(elemSize, count, alignment)
+        self.head = flatbuffers.number_types.UOffsetTFlags.py_type(self.Head() - size)
+        self.Bytes[self.Head():self.Head()+size] = raw
+        return self.EndVector(count)
@@ -0,0 +1,269 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import numpy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = None
+
+from vertex_buffer import ReadMeshLayout, DecodeVertexBuffer
+from material_view import MaterialView, DecodeName
+from model_reader import ModelFile
+import profiling
+
+# #####################################################
+# Plain model description
+# #####################################################
+# Everything the importer needs from a .gfbmdl, as plain Python and NumPy
+# data that can cross process boundaries.
+class MeshData():
+    def __init__(self):
+        self.Layout = []
+        self.VertexCount = 0
+        self.Attributes = {}
+        self.Polygons = []
+
+class ModelData():
+    def __init__(self):
+        self.BoneNames = []
+        self.BoneTypes = numpy.zeros(0, dtype=numpy.uint32)
+        self.BoneParents = numpy.zeros(0, dtype=numpy.int32)
+        self.BoneVisible = numpy.zeros(0, dtype=numpy.bool_)
+        self.BoneTranslations = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.BoneRotations = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.BoneScales = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.Materials = []
+        self.Meshes = []
+        self.Groups = []
+
+def ReadVector(vec, default):
+    if vec is None:
+        return default
+    return (vec.X(), vec.Y(), vec.Z())
+
+def DecodeBones(data, mon):
+    boneLen = mon.BonesLength()
+    data.BoneTypes = numpy.zeros(boneLen, dtype=numpy.uint32)
+    data.BoneParents = numpy.zeros(boneLen, dtype=numpy.int32)
+    data.BoneVisible = numpy.zeros(boneLen, dtype=numpy.bool_)
+    data.BoneTranslations = numpy.zeros((boneLen, 3), dtype=numpy.float32)
+    data.BoneRotations = numpy.zeros((boneLen, 3), dtype=numpy.float32)
+    data.BoneScales = numpy.ones((boneLen, 3), dtype=numpy.float32)
+    for i in range(boneLen):
+        bone = mon.Bones(i)
+        data.BoneNames.append(DecodeName(bone.Name()))
+        data.BoneTypes[i] = bone.BoneType()
+        data.BoneParents[i] = bone.Parent()
+        data.BoneVisible[i] = bone.Visible()
+        data.BoneTranslations[i] = ReadVector(bone.Translation(), (0.0, 0.0, 0.0))
+        data.BoneRotations[i] = ReadVector(bone.Rotation(), (0.0, 0.0, 0.0))
+        data.BoneScales[i] = ReadVector(bone.Scale(), (1.0, 1.0, 1.0))
+
+def DecodeMesh(mesh):
+    data = MeshData()
+    data.Layout = ReadMeshLayout(mesh)
+    rawData = mesh.DataAsNumpy()
+    if isinstance(rawData, int):
+        rawData = numpy.zeros(0, dtype=numpy.uint8)
+    # Copy out of the file mapping so the data outlives it
+    with profiling.Phase("vertex decode"):
+        for vtype, values in DecodeVertexBuffer(rawData, data.Layout).items():
+            data.Attributes[vtype] = numpy.ascontiguousarray(values).copy()
+            data.VertexCount = len(values)
+    for poly in range(mesh.PolygonsLength()):
+        polygon = mesh.Polygons(poly)
+        faces = polygon.FacesAsNumpy()
+        if isinstance(faces, int):
+            continue
+        data.Polygons.append((polygon.MaterialIndex(), numpy.array(faces, dtype=numpy.uint16)))
+    return data
+
+def DecodeModel(mon):
+    data = ModelData()
+    with profiling.Phase("bone decode"):
+        DecodeBones(data, mon)
+    with profiling.Phase("material decode"):
+        for i in range(mon.MaterialsLength()):
+            data.Materials.append(MaterialView(mon.Materials(i)))
+    for i in range(mon.MeshesLength()):
+        data.Meshes.append(DecodeMesh(mon.Meshes(i)))
+    for i in range(mon.GroupsLength()):
+        group = mon.Groups(i)
+        data.Groups.append((group.BoneIndex(), group.MeshIndex()))
+    return data
+
+# Meshes are named after the bone of the group that references them
+def GetMeshNames(data):
+    meshBones = dict((meshIdx, boneIdx) for boneIdx, meshIdx in data.Groups)
+    names = []
+    for i in range(len(data.Meshes)):
+        boneIdx = meshBones.get(i, 0)
+        names.append(data.BoneNames[boneIdx] if boneIdx < len(data.BoneNames) else "Mesh%d" % i)
+    return names
+
+def DecodeModelFile(path):
+    with ModelFile(path) as modelFile:
+        profiling.Count("bytes_read", len(modelFile))
+        return DecodeModel(modelFile.model)
+
+# #####################################################
+# Shared memory transport
+# #####################################################
+class SharedSlot():
+    __slots__ = ['Offset', 'Dtype', 'Shape']
+
+    def __init__(self, offset, dtype, shape):
+        self.Offset = offset
+        self.Dtype = dtype
+        self.Shape = shape
+
+def MapArrays(obj, func):
+    if isinstance(obj, (numpy.ndarray, SharedSlot)):
+        return func(obj)
+    if isinstance(obj, list):
+        return [MapArrays(x, func) for x in obj]
+    if isinstance(obj, tuple):
+        return tuple(MapArrays(x, func) for x in obj)
+    if isinstance(obj, dict):
+        return dict((k, MapArrays(v, func)) for k, v in obj.items())
+    if isinstance(obj, (ModelData, MeshData)):
+        for k, v in vars(obj).items():
+            setattr(obj, k, MapArrays(v, func))
+    return obj
+
+# Windows frees a block as soon as its last handle closes, so a worker
+# keeps the blocks it created, by task index, until the parent flags them
+# as attached in `attachedFlags`
+sharedBlocks = {}
+attachedFlags = None
+
+def InitWorker(flags):
+    global attachedFlags
+    attachedFlags = flags
+
+def ReleaseAttached():
+    for index in [i for i in sharedBlocks if attachedFlags[i]]:
+        sharedBlocks.pop(index).close()
+
+def ShareArrays(data, index):
+    arrays = []
+    def collect(arr):
+        arrays.append(arr)
+        return arr
+    MapArrays(data, collect)
+    total = sum((a.nbytes + 15) & ~15 for a in arrays)
+    if total == 0:
+        return data, None
+
+    block = shared_memory.SharedMemory(create=True, size=total)
+    off = [0]
+    def share(arr):
+        slot = SharedSlot(off[0], arr.dtype.str, arr.shape)
+        numpy.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf, offset=off[0])[...] = arr
+        off[0] += (arr.nbytes + 15) & ~15
+        return slot
+    data = MapArrays(data, share)
+    # The parent unlinks the block once it has read it
+    if os.name == 'nt':
+        sharedBlocks[index] = block
+    else:
+        resource_tracker.unregister(block._name, "shared_memory")
+        block.close()
+    return data, block.name
+
+def ReceiveArrays(data, name):
+    if name is None:
+        return data
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        data = MapArrays(data, lambda s: numpy.ndarray(s.Shape, dtype=s.Dtype, buffer=block.buf, offset=s.Offset).copy())
+    finally:
+        block.close()
+        block.unlink()
+    return data
+
+# Frees a block the parent never read
+def DiscardArrays(name):
+    if name is None:
+        return
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+def DecodeWorker(index, path):
+    if attachedFlags is not None:
+        ReleaseAttached()
+    data = DecodeModelFile(path)
+    if shared_memory is None:
+        return data, None
+    return ShareArrays(data, index)
+
+# #####################################################
+# Batch decoding
+# #####################################################
+# Decodes every file in a process pool and yields (path, ModelData) in the
+# order given, so the caller can build datablocks while later files decode.
+def DecodeModels(paths, jobs=0):
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(paths))
+    if jobs <= 1:
+        for path in paths:
+            yield path, DecodeModelFile(path)
+        return
+
+    flags = None
+    if os.name == 'nt' and shared_memory is not None:
+        flags = multiprocessing.RawArray('b', len(paths))
+    try:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=InitWorker, initargs=(flags,))
+    except (OSError, NotImplementedError):
+        for path in paths:
+            yield path, DecodeModelFile(path)
+        return
+
+    futures = []
+    received = 0
+    try:
+        futures = [pool.submit(DecodeWorker, i, path) for i, path in enumerate(paths)]
+        for i, (path, future) in enumerate(zip(paths, futures)):
+            try:
+                data = ReceiveArrays(*future.result())
+            except BrokenProcessPool:
+                data = DecodeModelFile(path)
+            received = i + 1
+            if flags is not None:
+                flags[i] = 1
+            yield path, data
+    finally:
+        # The caller stopped early: drop what has not started and free the
+        # blocks of files decoded but never received
+        for future in futures[received:]:
+            future.cancel()
+        pool.shutdown(wait=True)
+        for future in futures[received:]:
+            if not future.cancelled() and future.exception() is None:
+                DiscardArrays(future.result()[1])
@@ -0,0 +1,332 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Direct encoder for the gfbmdl schema. Pass one walks a ModelDesc in the
+# same order as model_writer.WriteModel and lays out every string, vector,
+# table and vtable the way flatbuffers.Builder would, measured from the end
+# of the buffer. Pass two allocates the file once and packs everything with
+# precompiled structs, so the output is byte for byte the same.
+
+import os
+import sys
+import struct
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+from model_writer import ParamKey, BlockKey, TexMapKey, MappingKey, TexMapsKey, CommonKey, BoneRows
+import profiling
+
+# #####################################################
+# Table layouts
+# #####################################################
+# Field formats: 'o' is an offset, 'v3' a Vector3/ColorRGB32, 'bb' a BoundingBox
+FieldFormats = {
+    'o': ('I', 4, 4),
+    'I': ('I', 4, 4),
+    'i': ('i', 4, 4),
+    'f': ('f', 4, 4),
+    'B': ('B', 1, 1),
+    '?': ('?', 1, 1),
+    'v3': ('3f', 12, 4),
+    'bb': ('6f', 24, 4),
+}
+
+class TableLayout():
+    __slots__ = ['Size', 'Fields', 'Key', 'Vtable', 'Struct']
+
+# Layout of one table depends only on which fields are set and on the
+# buffer alignment where it starts, so it is computed once per combination
+class TableType():
+    __slots__ = ['NumFields', 'Fields', 'Layouts']
+
+    def __init__(self, numFields, fields):
+        # (slot, format) in the order the writer adds them
+        self.NumFields = numFields
+        self.Fields = fields
+        self.Layouts = {}
+
+    def Layout(self, mask, align):
+        layout = self.Layouts.get((mask, align))
+        if layout is None:
+            layout = self.BuildLayout(mask, align)
+            self.Layouts[(mask, align)] = layout
+        return layout
+
+    def BuildLayout(self, mask, align):
+        off = align
+        slots = [0] * self.NumFields
+        placed = []
+        for i, ((slot, format), present) in enumerate(zip(self.Fields, mask)):
+            if not present:
+                continue
+            code, size, alignment = FieldFormats[format]
+            pad = (-off) & (alignment - 1)
+            off += pad + size
+            slots[slot] = off
+            placed.append((i, format, code, pad, off))
+        pad = (-off) & 3
+        objectOff = off + pad + 4
+
+        # Memory order is the reverse of the order fields were prepended
+        layout = TableLayout()
+        layout.Size = objectOff - align
+        code = '<i' + 'x' * pad
+        layout.Fields = []
+        for i, format, fieldCode, fieldPad, fieldOff in reversed(placed):
+            code += fieldCode + 'x' * fieldPad
+            layout.Fields.append((i, objectOff - fieldOff, format))
+        layout.Struct = struct.Struct(code)
+
+        entries = [objectOff - s if s else 0 for s in slots]
+        while entries and entries[-1] == 0:
+            entries.pop()
+        layout.Key = tuple(reversed(entries))
+        layout.Vtable = struct.pack('<%dH' % (len(entries) + 2), (len(entries) + 2) * 2, layout.Size, *entries)
+        return layout
+
+MaterialTable = TableType(21, [(0, 'o'), (1, 'o'), (2, 'i'), (3, 'B'), (4, 'B'), (5, 'i'), (6, 'i'), (7, 'i'), (8, 'i'), (9, 'i'), (10, 'i'),
+                               (11, 'o'), (12, 'o'), (13, 'o'), (14, 'o'), (15, 'B'), (16, 'B'), (17, 'B'), (18, 'B'), (19, 'B'), (20, 'o')])
+MatSwitchTable = TableType(2, [(0, 'o'), (1, '?')])
+MatFloatTable = TableType(2, [(0, 'o'), (1, 'f')])
+MatIntTable = TableType(2, [(0, 'o'), (1, 'i')])
+MatColorTable = TableType(2, [(0, 'o'), (1, 'v3')])
+MaterialCommonTable = TableType(3, [(0, 'o'), (1, 'o'), (2, 'o')])
+TextureMappingTable = TableType(9, [(0, 'I'), (1, 'I'), (2, 'I'), (3, 'I'), (4, 'I'), (5, 'I'), (6, 'I'), (7, 'I'), (8, 'f')])
+TextureMapTable = TableType(3, [(0, 'o'), (1, 'i'), (2, 'o')])
+MeshPolygonTable = TableType(2, [(0, 'I'), (1, 'o')])
+MeshAttributeTable = TableType(3, [(0, 'I'), (1, 'I'), (2, 'I')])
+MeshTable = TableType(3, [(0, 'o'), (1, 'o'), (2, 'o')])
+GroupTable = TableType(4, [(0, 'I'), (1, 'I'), (2, 'bb')])
+BoneTable = TableType(11, [(0, 'o'), (1, 'I'), (2, 'i'), (3, 'I'), (4, '?'), (5, 'v3'), (6, 'v3'), (7, 'v3'), (8, 'v3')])
+ModelTable = TableType(11, [(0, 'I'), (1, 'bb'), (2, 'o'), (3, 'o'), (4, 'o'), (5, 'o'), (6, 'o'), (7, 'o'), (8, 'o'), (9, 'o'), (10, 'o')])
+
+UInt32 = struct.Struct('<I')
+VectorStructs = {}
+
+def VectorStruct(count):
+    s = VectorStructs.get(count)
+    if s is None:
+        s = struct.Struct('<%dI' % (count + 1))
+        VectorStructs[count] = s
+    return s
+
+# #####################################################
+# Pass one: layout
+# #####################################################
+# Offsets are distances from the end of the buffer, like Builder.Offset()
+class ModelLayout():
+    __slots__ = ['off', 'vtables', 'strings', 'objects', 'packs', 'copies']
+
+    def __init__(self):
+        self.off = 0
+        self.vtables = {}
+        self.strings = {}
+        self.objects = {}
+        # (struct, offset, values) and (offset, bytes) for pass two
+        self.packs = []
+        self.copies = []
+
+    def String(self, s):
+        off = self.strings.get(s)
+        if off is not None:
+            profiling.Count("strings_shared")
+            return off
+        profiling.Count("strings_written")
+        x = s.encode('utf-8')
+        off = self.off
+        off += ((-(off + len(x) + 1)) & 3) + 1 + len(x) + 4
+        self.copies.append((off, UInt32.pack(len(x)) + x))
+        self.strings[s] = off
+        self.off = off
+        return off
+
+    def Shared(self, key, create, *args):
+        off = self.objects.get(key)
+        if off is None:
+            profiling.Count("objects_written")
+            off = create(self, *args)
+            self.objects[key] = off
+        else:
+            profiling.Count("objects_shared")
+        return off
+
+    def OffsetVector(self, offs):
+        count = len(offs)
+        start = self.off + ((-self.off) & 3)
+        off = start + 4 * count + 4
+        values = [start + 4 * (count - i) - o for i, o in enumerate(offs)]
+        self.packs.append((VectorStruct(count), off, [count] + values))
+        self.off = off
+        return off
+
+    def StringVector(self, strings):
+        return self.OffsetVector([self.String(s) for s in strings])
+
+    def BulkVector(self, data, elemSize):
+        if isinstance(data, numpy.ndarray):
+            raw = memoryview(numpy.ascontiguousarray(data)).cast('B')
+        else:
+            raw = memoryview(data).cast('B')
+        count = len(raw) // elemSize
+        off = self.off + ((-(self.off + elemSize * count)) & 3) + len(raw)
+        self.copies.append((off, raw))
+        off += 4
+        self.packs.append((UInt32, off, [count]))
+        self.off = off
+        return off
+
+    # `values` follows the table's field list: 0 or None leaves a field unset
+    def Table(self, table, values):
+        mask = tuple(v is not None and v != 0 for v in values)
+        layout = table.Layout(mask, self.off & 3)
+        objectOff = self.off + layout.Size
+        args = []
+        for i, rel, format in layout.Fields:
+            v = values[i]
+            if format == 'o':
+                args.append(objectOff - rel - v)
+            elif format == 'v3' or format == 'bb':
+                args.extend(v)
+            else:
+                args.append(v)
+
+        vtable = self.vtables.get(layout.Key)
+        if vtable is None:
+            vtable = objectOff + len(layout.Vtable)
+            self.copies.append((vtable, layout.Vtable))
+            self.vtables[layout.Key] = vtable
+            self.off = vtable
+        else:
+            self.off = objectOff
+        self.packs.append((layout.Struct, objectOff, [vtable - objectOff] + args))
+        return objectOff
+
+    def Finish(self, root):
+        off = self.off + ((-self.off) & 3) + 4
+        self.packs.append((UInt32, off, [off - root]))
+        self.off = off
+
+# #####################################################
+# Materials
+# #####################################################
+def EncodeBoolSwitch(l, name, value):
+    return l.Table(MatSwitchTable, (l.String(name), value))
+
+def EncodeFloatValue(l, name, value):
+    return l.Table(MatFloatTable, (l.String(name), value))
+
+def EncodeIntValue(l, name, value):
+    return l.Table(MatIntTable, (l.String(name), value))
+
+def EncodeColorValue(l, name, rgb):
+    return l.Table(MatColorTable, (l.String(name), tuple(rgb[:3])))
+
+def EncodeParamVector(l, block, tag, create):
+    return l.OffsetVector([l.Shared(ParamKey(tag, name, value), create, name, value) for name, value in block.Items()])
+
+def SharedParamVector(l, block, tag, create):
+    if block is None:
+        return 0
+    return l.Shared(BlockKey(block), EncodeParamVector, block, tag, create)
+
+def EncodeMapping(l, mapping):
+    return l.Table(TextureMappingTable, tuple(mapping))
+
+def EncodeTexMap(l, texMap):
+    sampler, index, mapping = texMap
+    name = l.String(sampler)
+    params = l.Shared(MappingKey(mapping), EncodeMapping, mapping)
+    return l.Table(TextureMapTable, (name, index, params))
+
+def EncodeTexMaps(l, texMaps):
+    return l.OffsetVector([l.Shared(TexMapKey(t), EncodeTexMap, t) for t in texMaps])
+
+def EncodeMatCommon(l, mat):
+    switches = SharedParamVector(l, mat.CommonSwitches, "MatSwitch", EncodeBoolSwitch)
+    vals = SharedParamVector(l, mat.CommonValues, "MatInt", EncodeIntValue)
+    cols = SharedParamVector(l, mat.CommonColors, "MatColor", EncodeColorValue)
+    return l.Table(MaterialCommonTable, (switches, vals, cols))
+
+def EncodeMaterial(l, mat):
+    name = l.String(mat.Name)
+    shdr = l.String(mat.ShaderGroup)
+    tex = l.Shared(TexMapsKey(mat.TextureMaps), EncodeTexMaps, mat.TextureMaps)
+    switches = SharedParamVector(l, mat.Switches, "MatSwitch", EncodeBoolSwitch)
+    vals = SharedParamVector(l, mat.Values, "MatFloat", EncodeFloatValue)
+    cols = SharedParamVector(l, mat.Colors, "MatColor", EncodeColorValue)
+    common = l.Shared(CommonKey(mat), EncodeMatCommon, mat)
+    return l.Table(MaterialTable, (name, shdr, mat.RenderLayer, mat.Unknown1, mat.Unknown2,
+                                   mat.Parameter1, mat.Parameter2, mat.Parameter3, mat.ShaderIndex, mat.Parameter4, mat.Parameter5,
+                                   tex, switches, vals, cols,
+                                   mat.Unknown3, mat.Unknown4, mat.Unknown5, mat.Unknown6, mat.Unknown7, common))
+
+# #####################################################
+# Meshes
+# #####################################################
+def EncodeMesh(l, mesh):
+    polys = []
+    for matIdx, faces in mesh.Polygons:
+        faces = numpy.asarray(faces, dtype='<u2')
+        data = l.BulkVector(faces, 2) if len(faces) > 0 else 0
+        polys.append(l.Table(MeshPolygonTable, (int(matIdx), data)))
+    polyVec = l.OffsetVector(polys)
+    attrVec = l.OffsetVector([l.Table(MeshAttributeTable, (int(t), int(f), int(c))) for t, f, c in mesh.Layout])
+    data = l.BulkVector(mesh.Data, 1)
+    return l.Table(MeshTable, (polyVec, attrVec, data))
+
+def EncodeGroup(l, boneIdx, meshIdx, bbMin, bbMax):
+    return l.Table(GroupTable, (boneIdx, meshIdx, (bbMin[0], bbMin[1], bbMin[2], bbMax[0], bbMax[1], bbMax[2])))
+
+def EncodeBone(l, name, type, parent, visible, scale, rot, trans, radiusStart):
+    return l.Table(BoneTable, (l.String(name), type, parent, 0, visible, scale, rot, trans, radiusStart))
+
+# #####################################################
+# Model
+# #####################################################
+def LayoutModel(desc):
+    l = ModelLayout()
+    texNames = l.StringVector(desc.TextureNames)
+    shdrNames = l.StringVector(desc.ShaderNames)
+    unk = l.OffsetVector([])
+    matNames = l.StringVector(desc.MaterialNames)
+    mats = l.OffsetVector([EncodeMaterial(l, m) for m in desc.Materials])
+    meshes = l.OffsetVector([EncodeMesh(l, m) for m in desc.Meshes])
+    groups = l.OffsetVector([EncodeGroup(l, *g) for g in desc.Groups])
+    bones = l.OffsetVector([EncodeBone(l, *b) for b in BoneRows(desc)])
+    colData = l.OffsetVector([])
+    model = l.Table(ModelTable, (desc.Version, tuple(desc.Bounding), texNames, shdrNames, unk, matNames, mats, groups, meshes, bones, colData))
+    l.Finish(model)
+    return l
+
+# #####################################################
+# Pass two: write
+# #####################################################
+def WriteLayout(l):
+    size = l.off
+    # The whole model is allocated once, at its final size
+    profiling.Count("builder_grow_events")
+    profiling.Count("encode_buffer_bytes", size)
+    buf = bytearray(size)
+    for packer, off, values in l.packs:
+        packer.pack_into(buf, size - off, *values)
+    for off, data in l.copies:
+        pos = size - off
+        buf[pos:pos + len(data)] = data
+    return buf
+
+def EncodeModel(desc):
+    with profiling.Phase("encode layout"):
+        l = LayoutModel(desc)
+    with profiling.Phase("encode write"):
+        return WriteLayout(l)
@@ -0,0 +1,54 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import mmap
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+import model_tables
+
+# Read-only mapping of a .gfbmdl file. Every accessor of `model` reads
+# straight from the mapping, so DataAsNumpy/FacesAsNumpy return read-only
+# views into the file and the mapping can be shared between threads.
+class ModelFile():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            if os.fstat(self.file.fileno()).st_size == 0:
+                raise ValueError("Empty model file: %s" % path)
+            self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self.file.close()
+            raise
+        self.model = model_tables.Model.GetRootAsModel(self.mapping, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.mapping)
+
+    def close(self):
+        self.model = None
+        try:
+            self.mapping.close()
+        except BufferError:
+            # Arrays still reference the mapping, it is unmapped once they are freed
+            pass
+        self.file.close()
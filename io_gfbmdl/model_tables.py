@@ -0,0 +1,345 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Read layer with the same accessors as the generated Gfbmdl classes. A
+# table reads its vtable once when it is created and keeps the field
+# offsets; vtables are cached per buffer since most tables share a few.
+# Structs such as Vector3 and BoundingBox are read with one unpack_from.
+
+import struct
+import numpy
+
+# Largest field count of any table in the schema
+MAX_FIELDS = 21
+
+SOffset = struct.Struct('<i')
+UOffset = struct.Struct('<I')
+VOffset = struct.Struct('<H')
+VtableStructs = [struct.Struct('<%dH' % n) for n in range(MAX_FIELDS + 1)]
+NoFields = (0,) * MAX_FIELDS
+
+# Field offsets of the vtable at `vt`, padded to MAX_FIELDS
+def ReadVtable(buf, vt):
+    count = min((VOffset.unpack_from(buf, vt)[0] - 4) // 2, MAX_FIELDS)
+    return VtableStructs[count].unpack_from(buf, vt + 4) + NoFields[count:]
+
+def ReadString(buf, pos):
+    pos += UOffset.unpack_from(buf, pos)[0]
+    start = pos + 4
+    return bytes(buf[start:start + UOffset.unpack_from(buf, pos)[0]])
+
+# #####################################################
+# Base classes
+# #####################################################
+class Table():
+    __slots__ = ['_buf', '_pos', '_fields', '_vtables']
+
+    def Init(self, buf, pos, vtables=None):
+        if vtables is None:
+            vtables = {}
+        vt = pos - SOffset.unpack_from(buf, pos)[0]
+        fields = vtables.get(vt)
+        if fields is None:
+            fields = ReadVtable(buf, vt)
+            vtables[vt] = fields
+        self._buf = buf
+        self._pos = pos
+        self._fields = fields
+        self._vtables = vtables
+
+    # Position of the vector a field points to, or 0
+    def _Vector(self, index):
+        o = self._fields[index]
+        if o == 0:
+            return 0
+        pos = self._pos + o
+        return pos + UOffset.unpack_from(self._buf, pos)[0]
+
+    @classmethod
+    def GetRoot(cls, buf, offset):
+        obj = cls()
+        obj.Init(buf, offset + UOffset.unpack_from(buf, offset)[0])
+        return obj
+
+class Struct():
+    __slots__ = ['_values']
+    FORMAT = None
+
+    def Init(self, buf, pos):
+        self._values = self.FORMAT.unpack_from(buf, pos)
+
+    def Values(self):
+        return self._values
+
+# #####################################################
+# Accessor factories
+# #####################################################
+# `index` is the field number in the schema, voffset (index + 2) * 2
+def Scalar(index, format, default):
+    unpack = struct.Struct('<' + format).unpack_from
+    def get(self):
+        o = self._fields[index]
+        if o == 0:
+            return default
+        return unpack(self._buf, self._pos + o)[0]
+    return get
+
+def String(index):
+    def get(self):
+        o = self._fields[index]
+        if o == 0:
+            return None
+        return ReadString(self._buf, self._pos + o)
+    return get
+
+def StructField(index, type):
+    def get(self):
+        o = self._fields[index]
+        if o == 0:
+            return None
+        obj = type()
+        obj._values = type.FORMAT.unpack_from(self._buf, self._pos + o)
+        return obj
+    return get
+
+def TableField(index, type):
+    def get(self):
+        o = self._fields[index]
+        if o == 0:
+            return None
+        pos = self._pos + o
+        obj = type()
+        obj.Init(self._buf, pos + UOffset.unpack_from(self._buf, pos)[0], self._vtables)
+        return obj
+    return get
+
+def VectorLength(index, default=0):
+    def length(self):
+        vec = self._Vector(index)
+        if vec == 0:
+            return default
+        return UOffset.unpack_from(self._buf, vec)[0]
+    return length
+
+# Returns (element, length)
+def TableVector(index, type):
+    def get(self, j):
+        vec = self._Vector(index)
+        if vec == 0:
+            return None
+        pos = vec + 4 + j * 4
+        obj = type()
+        obj.Init(self._buf, pos + UOffset.unpack_from(self._buf, pos)[0], self._vtables)
+        return obj
+    return get, VectorLength(index)
+
+def StringVector(index):
+    def get(self, j):
+        vec = self._Vector(index)
+        if vec == 0:
+            return ""
+        return ReadString(self._buf, vec + 4 + j * 4)
+    return get, VectorLength(index)
+
+# Returns (element, AsNumpy, length)
+def ScalarVector(index, format):
+    unpack = struct.Struct('<' + format).unpack_from
+    dtype = numpy.dtype('<' + format)
+    size = dtype.itemsize
+    def get(self, j):
+        vec = self._Vector(index)
+        if vec == 0:
+            return 0
+        return unpack(self._buf, vec + 4 + j * size)[0]
+    def asNumpy(self):
+        vec = self._Vector(index)
+        if vec == 0:
+            return 0
+        return numpy.frombuffer(self._buf, dtype=dtype, count=UOffset.unpack_from(self._buf, vec)[0], offset=vec + 4)
+    return get, asNumpy, VectorLength(index)
+
+def StructValue(index):
+    def get(self):
+        return self._values[index]
+    return get
+
+# #####################################################
+# Structs
+# #####################################################
+class Vector3(Struct):
+    __slots__ = []
+    FORMAT = struct.Struct('<3f')
+    X = StructValue(0)
+    Y = StructValue(1)
+    Z = StructValue(2)
+
+class ColorRGB32(Struct):
+    __slots__ = []
+    FORMAT = struct.Struct('<3f')
+    R = StructValue(0)
+    G = StructValue(1)
+    B = StructValue(2)
+
+class BoundingBox(Struct):
+    __slots__ = []
+    FORMAT = struct.Struct('<6f')
+    MinX = StructValue(0)
+    MinY = StructValue(1)
+    MinZ = StructValue(2)
+    MaxX = StructValue(3)
+    MaxY = StructValue(4)
+    MaxZ = StructValue(5)
+
+class BoneRigidData(Struct):
+    __slots__ = []
+    FORMAT = struct.Struct('<b')
+    Unknown1 = StructValue(0)
+
+# #####################################################
+# Tables
+# #####################################################
+class MatSwitch(Table):
+    __slots__ = []
+    Name = String(0)
+    Value = Scalar(1, '?', False)
+
+class MatFloat(Table):
+    __slots__ = []
+    Name = String(0)
+    Value = Scalar(1, 'f', 0.0)
+
+class MatInt(Table):
+    __slots__ = []
+    Name = String(0)
+    Value = Scalar(1, 'i', 0)
+
+class MatColor(Table):
+    __slots__ = []
+    Name = String(0)
+    Color = StructField(1, ColorRGB32)
+
+class TextureMapping(Table):
+    __slots__ = []
+    Unknown1 = Scalar(0, 'I', 0)
+    WrapModeX = Scalar(1, 'I', 0)
+    WrapModeY = Scalar(2, 'I', 0)
+    WrapModeZ = Scalar(3, 'I', 0)
+    Unknown5 = Scalar(4, 'I', 0)
+    Unknown6 = Scalar(5, 'I', 0)
+    Unknown7 = Scalar(6, 'I', 0)
+    Unknown8 = Scalar(7, 'I', 0)
+    LodBias = Scalar(8, 'f', 0.0)
+
+class TextureMap(Table):
+    __slots__ = []
+    Sampler = String(0)
+    Index = Scalar(1, 'i', 0)
+    Params = TableField(2, TextureMapping)
+
+class MaterialCommon(Table):
+    __slots__ = []
+    Switches, SwitchesLength = TableVector(0, MatSwitch)
+    Values, ValuesLength = TableVector(1, MatInt)
+    Colors, ColorsLength = TableVector(2, MatColor)
+
+class Material(Table):
+    __slots__ = []
+    Name = String(0)
+    ShaderGroup = String(1)
+    RenderLayer = Scalar(2, 'i', 0)
+    Unknown1 = Scalar(3, 'B', 0)
+    Unknown2 = Scalar(4, 'B', 0)
+    Parameter1 = Scalar(5, 'i', 0)
+    Parameter2 = Scalar(6, 'i', 0)
+    Parameter3 = Scalar(7, 'i', 0)
+    ShaderIndex = Scalar(8, 'i', 0)
+    Parameter4 = Scalar(9, 'i', 0)
+    Parameter5 = Scalar(10, 'i', 0)
+    TextureMaps, TextureMapsLength = TableVector(11, TextureMap)
+    Switches, SwitchesLength = TableVector(12, MatSwitch)
+    Values, ValuesLength = TableVector(13, MatFloat)
+    Colors, ColorsLength = TableVector(14, MatColor)
+    Unknown3 = Scalar(15, 'B', 0)
+    Unknown4 = Scalar(16, 'B', 0)
+    Unknown5 = Scalar(17, 'B', 0)
+    Unknown6 = Scalar(18, 'B', 0)
+    Unknown7 = Scalar(19, 'B', 0)
+    Common = TableField(20, MaterialCommon)
+
+class MeshAttribute(Table):
+    __slots__ = []
+    VertexType = Scalar(0, 'I', 0)
+    BufferFormat = Scalar(1, 'I', 0)
+    ElementCount = Scalar(2, 'I', 0)
+
+class MeshPolygon(Table):
+    __slots__ = []
+    MaterialIndex = Scalar(0, 'I', 0)
+    Faces, FacesAsNumpy, FacesLength = ScalarVector(1, 'H')
+
+class Mesh(Table):
+    __slots__ = []
+    Polygons, PolygonsLength = TableVector(0, MeshPolygon)
+    Attributes, AttributesLength = TableVector(1, MeshAttribute)
+    Data, DataAsNumpy, DataLength = ScalarVector(2, 'B')
+
+class Group(Table):
+    __slots__ = []
+    BoneIndex = Scalar(0, 'I', 0)
+    MeshIndex = Scalar(1, 'I', 0)
+    Bounding = StructField(2, BoundingBox)
+    Layer = Scalar(3, 'I', 0)
+
+class Bone(Table):
+    __slots__ = []
+    Name = String(0)
+    BoneType = Scalar(1, 'I', 0)
+    Parent = Scalar(2, 'i', 0)
+    Zero = Scalar(3, 'I', 0)
+    Visible = Scalar(4, '?', False)
+    Scale = StructField(5, Vector3)
+    Rotation = StructField(6, Vector3)
+    Translation = StructField(7, Vector3)
+    RadiusStart = StructField(8, Vector3)
+    RadiusEnd = StructField(9, Vector3)
+    RigidCheck = StructField(10, BoneRigidData)
+
+class CollisionGroup(Table):
+    __slots__ = []
+    BoneIndex = Scalar(0, 'I', 0)
+    Unknown1 = Scalar(1, 'I', 0)
+    BoneChildren, BoneChildrenAsNumpy, BoneChildrenLength = ScalarVector(2, 'I')
+    Bounding = StructField(3, BoundingBox)
+
+class UnknownEmpty(Table):
+    __slots__ = []
+    Unk = Scalar(0, 'I', 0)
+
+class Model(Table):
+    __slots__ = []
+    Version = Scalar(0, 'I', 0)
+    Bounding = StructField(1, BoundingBox)
+    TextureNames, TextureNamesLength = StringVector(2)
+    ShaderNames, ShaderNamesLength = StringVector(3)
+    Unknown, UnknownLength = TableVector(4, UnknownEmpty)
+    MaterialNames, MaterialNamesLength = StringVector(5)
+    Materials, MaterialsLength = TableVector(6, Material)
+    Groups, GroupsLength = TableVector(7, Group)
+    Meshes, MeshesLength = TableVector(8, Mesh)
+    Bones, BonesLength = TableVector(9, Bone)
+    CollisionGroups, CollisionGroupsLength = TableVector(10, CollisionGroup)
+
+    @classmethod
+    def GetRootAsModel(cls, buf, offset):
+        return cls.GetRoot(buf, offset)
@@ -0,0 +1,347 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Plain description of a model to write, and the reference writer that goes
+# through flatbuffers.Builder and the generated Gfbmdl helpers. The direct
+# encoder in model_encoder.py writes the same bytes in the same order.
+
+import os
+import sys
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+import Gfbmdl.Bone
+import Gfbmdl.BoundingBox
+import Gfbmdl.Model
+import Gfbmdl.Material
+import Gfbmdl.Mesh
+import Gfbmdl.MeshAttribute
+import Gfbmdl.MeshPolygon
+import Gfbmdl.Group
+import Gfbmdl.MaterialCommon
+import Gfbmdl.MatFloat
+import Gfbmdl.MatInt
+import Gfbmdl.MatSwitch
+import Gfbmdl.MatColor
+import Gfbmdl.ColorRGB32
+import Gfbmdl.TextureMap
+import Gfbmdl.TextureMapping
+import Gfbmdl.Vector3
+from model_builder import ModelBuilder
+
+MODEL_VERSION = 403704096
+
+# #####################################################
+# Model description
+# #####################################################
+# Texture maps are (sampler, index, mapping) with mapping holding the nine
+# TextureMapping fields in schema order. Parameter lists are ParamBlocks
+# from shader_presets; blocks and tables with the same key are written once.
+class MaterialDesc():
+    def __init__(self, name, shaderGroup):
+        self.Name = name
+        self.ShaderGroup = shaderGroup
+        self.RenderLayer = 0
+        self.Unknown1 = 0
+        self.Unknown2 = 0
+        self.Parameter1 = 0
+        self.Parameter2 = 0
+        self.Parameter3 = 0
+        self.ShaderIndex = 0
+        self.Parameter4 = 0
+        self.Parameter5 = 0
+        self.Unknown3 = 0
+        self.Unknown4 = 0
+        self.Unknown5 = 0
+        self.Unknown6 = 0
+        self.Unknown7 = 0
+        self.TextureMaps = ()
+        self.Switches = None
+        self.Values = None
+        self.Colors = None
+        self.CommonSwitches = None
+        self.CommonValues = None
+        self.CommonColors = None
+
+# Data is the interleaved vertex buffer as uint8, Polygons is a list of
+# (material index, uint16 faces). Empty polygons are written without faces.
+class MeshDesc():
+    def __init__(self, layout, data, polygons):
+        self.Layout = layout
+        self.Data = data
+        self.Polygons = polygons
+
+class ModelDesc():
+    def __init__(self):
+        self.Version = MODEL_VERSION
+        self.Bounding = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        self.TextureNames = []
+        self.ShaderNames = []
+        self.MaterialNames = []
+        self.Materials = []
+        self.Meshes = []
+        # (bone index, mesh index, bbMin, bbMax)
+        self.Groups = []
+        self.BoneNames = []
+        self.BoneTypes = numpy.zeros(0, dtype=numpy.uint32)
+        self.BoneParents = numpy.zeros(0, dtype=numpy.int32)
+        self.BoneVisible = numpy.zeros(0, dtype=numpy.bool_)
+        self.BoneTranslations = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.BoneRotations = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.BoneScales = numpy.zeros((0, 3), dtype=numpy.float32)
+        # Optional (N, 3) array, not written when None
+        self.BoneRadiusStart = None
+
+# #####################################################
+# Sharing keys
+# #####################################################
+def ParamKey(tag, name, value):
+    return (tag, name, tuple(value) if isinstance(value, list) else value)
+
+def BlockKey(block):
+    return block.Key
+
+def TexMapKey(texMap):
+    return ("TextureMap",) + tuple(texMap)
+
+def MappingKey(mapping):
+    return ("TextureMapping",) + tuple(mapping)
+
+def TexMapsKey(texMaps):
+    return ("TextureMaps",) + tuple(texMaps)
+
+def CommonKey(mat):
+    return ("MatCommon",) + tuple(b.Key if b is not None else None for b in (mat.CommonSwitches, mat.CommonValues, mat.CommonColors))
+
+# #####################################################
+# Utils
+# #####################################################
+def CreateOffsetVector(builder, startVector, offs):
+    startVector(builder, len(offs))
+    for o in reversed(offs):
+        builder.PrependUOffsetTRelative(o)
+    return builder.EndVector(len(offs))
+
+def CreateStringVector(builder, startVector, strings):
+    return CreateOffsetVector(builder, startVector, [builder.CreateSharedString(s) for s in strings])
+
+def CreateVector3(builder, v):
+    return Gfbmdl.Vector3.CreateVector3(builder, v[0], v[1], v[2])
+
+# #####################################################
+# Materials
+# #####################################################
+def CreateBoolSwitch(builder, name, value):
+    Name = builder.CreateSharedString(name)
+    Gfbmdl.MatSwitch.MatSwitchStart(builder)
+    Gfbmdl.MatSwitch.MatSwitchAddName(builder, Name)
+    Gfbmdl.MatSwitch.MatSwitchAddValue(builder, value)
+    return Gfbmdl.MatSwitch.MatSwitchEnd(builder)
+
+def CreateFloatValue(builder, name, value):
+    Name = builder.CreateSharedString(name)
+    Gfbmdl.MatFloat.MatFloatStart(builder)
+    Gfbmdl.MatFloat.MatFloatAddName(builder, Name)
+    Gfbmdl.MatFloat.MatFloatAddValue(builder, value)
+    return Gfbmdl.MatFloat.MatFloatEnd(builder)
+
+def CreateIntValue(builder, name, value):
+    Name = builder.CreateSharedString(name)
+    Gfbmdl.MatInt.MatIntStart(builder)
+    Gfbmdl.MatInt.MatIntAddName(builder, Name)
+    Gfbmdl.MatInt.MatIntAddValue(builder, value)
+    return Gfbmdl.MatInt.MatIntEnd(builder)
+
+def CreateColorValue(builder, name, rgb):
+    Name = builder.CreateSharedString(name)
+    Gfbmdl.MatColor.MatColorStart(builder)
+    Gfbmdl.MatColor.MatColorAddName(builder, Name)
+    Gfbmdl.MatColor.MatColorAddColor(builder, Gfbmdl.ColorRGB32.CreateColorRGB32(builder, rgb[0], rgb[1], rgb[2]))
+    return Gfbmdl.MatColor.MatColorEnd(builder)
+
+def CreateParamVector(builder, block, tag, create, startVector):
+    params = []
+    for name, value in block.Items():
+        params.append(builder.CreateShared(ParamKey(tag, name, value), create, name, value))
+    return CreateOffsetVector(builder, startVector, params)
+
+def SharedParamVector(builder, block, tag, create, startVector):
+    if block is None:
+        return 0
+    return builder.CreateShared(BlockKey(block), CreateParamVector, block, tag, create, startVector)
+
+def CreateMapping(builder, mapping):
+    Gfbmdl.TextureMapping.TextureMappingStart(builder)
+    Gfbmdl.TextureMapping.TextureMappingAddUnknown1(builder, mapping[0])
+    Gfbmdl.TextureMapping.TextureMappingAddWrapModeX(builder, mapping[1])
+    Gfbmdl.TextureMapping.TextureMappingAddWrapModeY(builder, mapping[2])
+    Gfbmdl.TextureMapping.TextureMappingAddWrapModeZ(builder, mapping[3])
+    Gfbmdl.TextureMapping.TextureMappingAddUnknown5(builder, mapping[4])
+    Gfbmdl.TextureMapping.TextureMappingAddUnknown6(builder, mapping[5])
+    Gfbmdl.TextureMapping.TextureMappingAddUnknown7(builder, mapping[6])
+    Gfbmdl.TextureMapping.TextureMappingAddUnknown8(builder, mapping[7])
+    Gfbmdl.TextureMapping.TextureMappingAddLodBias(builder, mapping[8])
+    return Gfbmdl.TextureMapping.TextureMappingEnd(builder)
+
+def CreateTexMap(builder, texMap):
+    sampler, index, mapping = texMap
+    Name = builder.CreateSharedString(sampler)
+    params = builder.CreateShared(MappingKey(mapping), CreateMapping, mapping)
+    Gfbmdl.TextureMap.TextureMapStart(builder)
+    Gfbmdl.TextureMap.TextureMapAddSampler(builder, Name)
+    Gfbmdl.TextureMap.TextureMapAddIndex(builder, index)
+    Gfbmdl.TextureMap.TextureMapAddParams(builder, params)
+    return Gfbmdl.TextureMap.TextureMapEnd(builder)
+
+def CreateTexMaps(builder, texMaps):
+    maps = [builder.CreateShared(TexMapKey(t), CreateTexMap, t) for t in texMaps]
+    return CreateOffsetVector(builder, Gfbmdl.Material.MaterialStartTextureMapsVector, maps)
+
+def CreateMatCommon(builder, mat):
+    switches = SharedParamVector(builder, mat.CommonSwitches, "MatSwitch", CreateBoolSwitch, Gfbmdl.MaterialCommon.MaterialCommonStartSwitchesVector)
+    vals = SharedParamVector(builder, mat.CommonValues, "MatInt", CreateIntValue, Gfbmdl.MaterialCommon.MaterialCommonStartValuesVector)
+    cols = SharedParamVector(builder, mat.CommonColors, "MatColor", CreateColorValue, Gfbmdl.MaterialCommon.MaterialCommonStartColorsVector)
+    Gfbmdl.MaterialCommon.MaterialCommonStart(builder)
+    Gfbmdl.MaterialCommon.MaterialCommonAddSwitches(builder, switches)
+    Gfbmdl.MaterialCommon.MaterialCommonAddValues(builder, vals)
+    Gfbmdl.MaterialCommon.MaterialCommonAddColors(builder, cols)
+    return Gfbmdl.MaterialCommon.MaterialCommonEnd(builder)
+
+def CreateMaterial(builder, mat):
+    Name = builder.CreateSharedString(mat.Name)
+    Shdr = builder.CreateSharedString(mat.ShaderGroup)
+    tex = builder.CreateShared(TexMapsKey(mat.TextureMaps), CreateTexMaps, mat.TextureMaps)
+    switches = SharedParamVector(builder, mat.Switches, "MatSwitch", CreateBoolSwitch, Gfbmdl.Material.MaterialStartSwitchesVector)
+    vals = SharedParamVector(builder, mat.Values, "MatFloat", CreateFloatValue, Gfbmdl.Material.MaterialStartValuesVector)
+    cols = SharedParamVector(builder, mat.Colors, "MatColor", CreateColorValue, Gfbmdl.Material.MaterialStartColorsVector)
+    common = builder.CreateShared(CommonKey(mat), CreateMatCommon, mat)
+
+    Gfbmdl.Material.MaterialStart(builder)
+    Gfbmdl.Material.MaterialAddName(builder, Name)
+    Gfbmdl.Material.MaterialAddShaderGroup(builder, Shdr)
+    Gfbmdl.Material.MaterialAddRenderLayer(builder, mat.RenderLayer)
+    Gfbmdl.Material.MaterialAddUnknown1(builder, mat.Unknown1)
+    Gfbmdl.Material.MaterialAddUnknown2(builder, mat.Unknown2)
+    Gfbmdl.Material.MaterialAddParameter1(builder, mat.Parameter1)
+    Gfbmdl.Material.MaterialAddParameter2(builder, mat.Parameter2)
+    Gfbmdl.Material.MaterialAddParameter3(builder, mat.Parameter3)
+    Gfbmdl.Material.MaterialAddShaderIndex(builder, mat.ShaderIndex)
+    Gfbmdl.Material.MaterialAddParameter4(builder, mat.Parameter4)
+    Gfbmdl.Material.MaterialAddParameter5(builder, mat.Parameter5)
+    Gfbmdl.Material.MaterialAddTextureMaps(builder, tex)
+    Gfbmdl.Material.MaterialAddSwitches(builder, switches)
+    Gfbmdl.Material.MaterialAddValues(builder, vals)
+    Gfbmdl.Material.MaterialAddColors(builder, cols)
+    Gfbmdl.Material.MaterialAddUnknown3(builder, mat.Unknown3)
+    Gfbmdl.Material.MaterialAddUnknown4(builder, mat.Unknown4)
+    Gfbmdl.Material.MaterialAddUnknown5(builder, mat.Unknown5)
+    Gfbmdl.Material.MaterialAddUnknown6(builder, mat.Unknown6)
+    Gfbmdl.Material.MaterialAddUnknown7(builder, mat.Unknown7)
+    Gfbmdl.Material.MaterialAddCommon(builder, common)
+    return Gfbmdl.Material.MaterialEnd(builder)
+
+# #####################################################
+# Meshes
+# #####################################################
+def CreatePolygon(builder, matIdx, faces):
+    data = builder.CreateBulkVector(faces, 2, 2) if len(faces) > 0 else 0
+    Gfbmdl.MeshPolygon.MeshPolygonStart(builder)
+    Gfbmdl.MeshPolygon.MeshPolygonAddMaterialIndex(builder, matIdx)
+    Gfbmdl.MeshPolygon.MeshPolygonAddFaces(builder, data)
+    return Gfbmdl.MeshPolygon.MeshPolygonEnd(builder)
+
+def CreateAttribute(builder, vtype, format, count):
+    Gfbmdl.MeshAttribute.MeshAttributeStart(builder)
+    Gfbmdl.MeshAttribute.MeshAttributeAddVertexType(builder, vtype)
+    Gfbmdl.MeshAttribute.MeshAttributeAddBufferFormat(builder, format)
+    Gfbmdl.MeshAttribute.MeshAttributeAddElementCount(builder, count)
+    return Gfbmdl.MeshAttribute.MeshAttributeEnd(builder)
+
+def CreateMesh(builder, mesh):
+    polys = [CreatePolygon(builder, int(m), numpy.asarray(f, dtype='<u2')) for m, f in mesh.Polygons]
+    polyVec = CreateOffsetVector(builder, Gfbmdl.Mesh.MeshStartPolygonsVector, polys)
+    attrs = [CreateAttribute(builder, int(t), int(f), int(c)) for t, f, c in mesh.Layout]
+    attrVec = CreateOffsetVector(builder, Gfbmdl.Mesh.MeshStartAttributesVector, attrs)
+    data = builder.CreateBulkVector(mesh.Data, 1, 1)
+
+    Gfbmdl.Mesh.MeshStart(builder)
+    Gfbmdl.Mesh.MeshAddPolygons(builder, polyVec)
+    Gfbmdl.Mesh.MeshAddAttributes(builder, attrVec)
+    Gfbmdl.Mesh.MeshAddData(builder, data)
+    return Gfbmdl.Mesh.MeshEnd(builder)
+
+def CreateGroup(builder, boneIdx, meshIdx, bbMin, bbMax):
+    Gfbmdl.Group.GroupStart(builder)
+    Gfbmdl.Group.GroupAddBoneIndex(builder, boneIdx)
+    Gfbmdl.Group.GroupAddMeshIndex(builder, meshIdx)
+    Gfbmdl.Group.GroupAddBounding(builder, Gfbmdl.BoundingBox.CreateBoundingBox(builder, bbMin[0], bbMin[1], bbMin[2], bbMax[0], bbMax[1], bbMax[2]))
+    return Gfbmdl.Group.GroupEnd(builder)
+
+# #####################################################
+# Bones
+# #####################################################
+def CreateBone(builder, name, type, parent, visible, scale, rot, trans, radiusStart):
+    Name = builder.CreateSharedString(name)
+    Gfbmdl.Bone.BoneStart(builder)
+    Gfbmdl.Bone.BoneAddName(builder, Name)
+    Gfbmdl.Bone.BoneAddBoneType(builder, type)
+    Gfbmdl.Bone.BoneAddParent(builder, parent)
+    Gfbmdl.Bone.BoneAddZero(builder, 0)
+    Gfbmdl.Bone.BoneAddVisible(builder, visible)
+    Gfbmdl.Bone.BoneAddScale(builder, CreateVector3(builder, scale))
+    Gfbmdl.Bone.BoneAddRotation(builder, CreateVector3(builder, rot))
+    Gfbmdl.Bone.BoneAddTranslation(builder, CreateVector3(builder, trans))
+    if radiusStart is not None:
+        Gfbmdl.Bone.BoneAddRadiusStart(builder, CreateVector3(builder, radiusStart))
+    return Gfbmdl.Bone.BoneEnd(builder)
+
+# Bone arrays as plain Python lists, one row per bone
+def BoneRows(desc):
+    boneCnt = len(desc.BoneNames)
+    radius = desc.BoneRadiusStart.tolist() if desc.BoneRadiusStart is not None else [None] * boneCnt
+    return zip(desc.BoneNames, desc.BoneTypes.tolist(), desc.BoneParents.tolist(), [int(v) for v in desc.BoneVisible.tolist()],
+               desc.BoneScales.tolist(), desc.BoneRotations.tolist(), desc.BoneTranslations.tolist(), radius)
+
+# #####################################################
+# Model
+# #####################################################
+def WriteModel(builder, desc):
+    texNames = CreateStringVector(builder, Gfbmdl.Model.ModelStartTextureNamesVector, desc.TextureNames)
+    shdrNames = CreateStringVector(builder, Gfbmdl.Model.ModelStartShaderNamesVector, desc.ShaderNames)
+    unk = CreateOffsetVector(builder, Gfbmdl.Model.ModelStartUnknownVector, [])
+    matNames = CreateStringVector(builder, Gfbmdl.Model.ModelStartMaterialNamesVector, desc.MaterialNames)
+    mats = CreateOffsetVector(builder, Gfbmdl.Model.ModelStartMaterialsVector, [CreateMaterial(builder, m) for m in desc.Materials])
+    meshes = CreateOffsetVector(builder, Gfbmdl.Model.ModelStartMeshesVector, [CreateMesh(builder, m) for m in desc.Meshes])
+    groups = CreateOffsetVector(builder, Gfbmdl.Model.ModelStartGroupsVector, [CreateGroup(builder, *g) for g in desc.Groups])
+    bones = CreateOffsetVector(builder, Gfbmdl.Model.ModelStartBonesVector, [CreateBone(builder, *b) for b in BoneRows(desc)])
+    colData = CreateOffsetVector(builder, Gfbmdl.Model.ModelStartCollisionGroupsVector, [])
+
+    Gfbmdl.Model.ModelStart(builder)
+    Gfbmdl.Model.ModelAddVersion(builder, desc.Version)
+    Gfbmdl.Model.ModelAddBounding(builder, Gfbmdl.BoundingBox.CreateBoundingBox(builder, *desc.Bounding))
+    Gfbmdl.Model.ModelAddTextureNames(builder, texNames)
+    Gfbmdl.Model.ModelAddShaderNames(builder, shdrNames)
+    Gfbmdl.Model.ModelAddUnknown(builder, unk)
+    Gfbmdl.Model.ModelAddMaterialNames(builder, matNames)
+    Gfbmdl.Model.ModelAddMaterials(builder, mats)
+    Gfbmdl.Model.ModelAddGroups(builder, groups)
+    Gfbmdl.Model.ModelAddMeshes(builder, meshes)
+    Gfbmdl.Model.ModelAddBones(builder, bones)
+    Gfbmdl.Model.ModelAddCollisionGroups(builder, colData)
+    return Gfbmdl.Model.ModelEnd(builder)
+
+def BuildModel(desc, initialSize=0):
+    builder = ModelBuilder(initialSize)
+    builder.Finish(WriteModel(builder, desc))
+    return builder.Output()
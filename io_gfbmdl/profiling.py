@@ -0,0 +1,160 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Opt-in phase timing for import and export. Code marks its phases with
+#   with profiling.Phase("vertex decode"):
+# and bumps counters with profiling.Count("vertices", n). Both are no-ops
+# unless a Profiler has been started.
+
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+active = None
+
+class PhaseRecord():
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.peak = 0
+        self.calls = 0
+        self.children = []
+        self.childIndex = {}
+        self.start = 0.0
+        self.memStart = 0
+        self.peakSoFar = 0
+
+    def Child(self, name):
+        # Repeated phases with the same name under one parent are merged
+        if name not in self.childIndex:
+            self.childIndex[name] = len(self.children)
+            self.children.append(PhaseRecord(name))
+        return self.children[self.childIndex[name]]
+
+    def ToDict(self):
+        ret = {"name": self.name, "seconds": self.seconds, "calls": self.calls}
+        if self.peak:
+            ret["peak_bytes"] = self.peak
+        if self.children:
+            ret["children"] = [c.ToDict() for c in self.children]
+        return ret
+
+class Profiler():
+    def __init__(self, name, memory=True, cprofile=False):
+        self.root = PhaseRecord(name)
+        self.stack = [self.root]
+        self.counters = {}
+        self.memory = memory
+        self.profile = cProfile.Profile() if cprofile else None
+        self.startedTracing = False
+
+    def Start(self):
+        global active
+        active = self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.startedTracing = True
+        self.Enter(self.root)
+        if self.profile is not None:
+            self.profile.enable()
+        return self
+
+    def Stop(self):
+        global active
+        if self.profile is not None:
+            self.profile.disable()
+        self.Exit(self.root)
+        if self.startedTracing:
+            tracemalloc.stop()
+            self.startedTracing = False
+        if active is self:
+            active = None
+
+    def Enter(self, record):
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            parent = self.stack[-1]
+            parent.peakSoFar = max(parent.peakSoFar, peak)
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            record.memStart = current
+            record.peakSoFar = current
+        record.start = time.perf_counter()
+
+    def Exit(self, record):
+        record.seconds += time.perf_counter() - record.start
+        record.calls += 1
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(record.peakSoFar, peak)
+            record.peak = max(record.peak, peak - record.memStart)
+            if len(self.stack) > 1:
+                parent = self.stack[-2]
+                parent.peakSoFar = max(parent.peakSoFar, peak)
+
+    @contextmanager
+    def Phase(self, name):
+        record = self.stack[-1].Child(name)
+        self.stack.append(record)
+        self.Enter(record)
+        try:
+            yield record
+        finally:
+            self.Exit(record)
+            self.stack.pop()
+
+    def Count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def Report(self):
+        report = {"operation": self.root.name, "phases": self.root.ToDict(), "counters": dict(self.counters)}
+        rates = {}
+        if self.root.seconds > 0.0:
+            for name, value in self.counters.items():
+                rates[name + "_per_second"] = value / self.root.seconds
+        report["rates"] = rates
+        return report
+
+    def Summary(self):
+        lines = []
+        def walk(record, depth):
+            mem = " peak %8.2f MB" % (record.peak / 1048576.0) if record.peak else ""
+            lines.append("%-40s %10.3f ms x%-5d%s" % ("  " * depth + record.name, record.seconds * 1000.0, record.calls, mem))
+            for c in record.children:
+                walk(c, depth + 1)
+        walk(self.root, 0)
+        for name, value in sorted(self.counters.items()):
+            lines.append("%-40s %d" % (name, value))
+        return "\n".join(lines)
+
+    def Write(self, path):
+        with open(path + ".profile.json", 'w') as f:
+            json.dump(self.Report(), f, indent=2)
+        if self.profile is not None:
+            self.profile.dump_stats(path + ".prof")
+
+@contextmanager
+def NullPhase():
+    yield None
+
+def Phase(name):
+    if active is None:
+        return NullPhase()
+    return active.Phase(name)
+
+def Count(name, value=1):
+    if active is not None:
+        active.Count(name, value)
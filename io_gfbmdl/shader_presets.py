@@ -0,0 +1,153 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Material parameter presets, one JSON file per ShaderGroup in presets/.
+# Each file is validated and compiled once into ParamBlocks; materials then
+# only carry the handful of parameters they override.
+
+import os
+import json
+import numpy
+
+DEFAULT_SHADER = "PokeDefaultShader"
+PRESET_DIR = os.path.join(os.path.dirname(__file__), "presets")
+
+# #####################################################
+# Parameter blocks
+# #####################################################
+# Names and values of one parameter list (switches, values or colors).
+# Key identifies the content, so equal blocks can share one FlatBuffers
+# vector.
+class ParamBlock():
+    __slots__ = ['Names', 'Data', 'Index', 'Key']
+
+    def __init__(self, names, data, key):
+        self.Names = names
+        self.Data = data
+        self.Index = dict((n, i) for i, n in enumerate(names))
+        self.Key = key
+
+    def __len__(self):
+        return len(self.Names)
+
+    def Items(self):
+        return zip(self.Names, self.Data.tolist())
+
+    # Copy with some parameters replaced, or the block itself if nothing
+    # changes. Overrides of the wrong size are skipped with a warning.
+    def Override(self, overrides, material=None):
+        diff = []
+        width = self.Data[0].size if len(self.Data) else 1
+        for name, value in overrides.items():
+            i = self.Index.get(name)
+            if i is None:
+                continue
+            value = numpy.asarray(value, dtype=self.Data.dtype)
+            if value.size != width:
+                print("Warning: material %s property '%s' has %d values, expected %d. Ignored." % (material, name, value.size, width))
+                continue
+            value = value.reshape(self.Data.shape[1:])
+            if not numpy.array_equal(self.Data[i], value):
+                diff.append((i, value))
+        if not diff:
+            return self
+        data = self.Data.copy()
+        for i, value in diff:
+            data[i] = value
+        key = self.Key + tuple(sorted((self.Names[i], tuple(numpy.ravel(v).tolist())) for i, v in diff))
+        return ParamBlock(self.Names, data, key)
+
+class ShaderPreset():
+    __slots__ = ['Name', 'Switches', 'Values', 'Colors', 'CommonSwitches', 'CommonValues', 'CommonColors', 'TextureMaps']
+
+    def Blocks(self):
+        return (self.Switches, self.Values, self.Colors, self.CommonSwitches, self.CommonValues, self.CommonColors)
+
+    # Parameters of a material using this preset. Overrides are matched by
+    # name against every block.
+    def Resolve(self, overrides, material=None):
+        if not overrides:
+            return self
+        ret = ShaderPreset()
+        ret.Name = self.Name
+        ret.TextureMaps = self.TextureMaps
+        ret.Switches, ret.Values, ret.Colors, ret.CommonSwitches, ret.CommonValues, ret.CommonColors = [b.Override(overrides, material) for b in self.Blocks()]
+        return ret
+
+# #####################################################
+# Loading
+# #####################################################
+def RejectDuplicates(pairs):
+    ret = {}
+    for k, v in pairs:
+        if k in ret:
+            raise ValueError("duplicate key '%s'" % k)
+        ret[k] = v
+    return ret
+
+def CompileBlock(items, dtype, width, key, where):
+    if not isinstance(items, dict):
+        raise ValueError("%s must be an object" % where)
+    names = list(items.keys())
+    try:
+        data = numpy.array([items[n] for n in names], dtype=dtype)
+    except (TypeError, ValueError):
+        raise ValueError("%s has a value that is not a number" % where)
+    shape = (len(names), width) if width > 1 else (len(names),)
+    if data.size == 0:
+        data = numpy.zeros(shape, dtype=dtype)
+    if data.shape != shape:
+        raise ValueError("%s values must have %d components" % (where, width))
+    return ParamBlock(names, data, key)
+
+def LoadPreset(path):
+    try:
+        with open(path, 'r') as f:
+            desc = json.load(f, object_pairs_hook=RejectDuplicates)
+    except ValueError as e:
+        raise ValueError("%s: %s" % (path, e))
+
+    preset = ShaderPreset()
+    preset.Name = desc.get("ShaderGroup", os.path.splitext(os.path.basename(path))[0])
+    common = desc.get("Common", {})
+    def block(section, key, label, dtype, width):
+        return CompileBlock(section.get(key, {}), dtype, width, (preset.Name, label), "%s: %s" % (path, label))
+
+    preset.Switches = block(desc, "Switches", "Switches", numpy.bool_, 1)
+    preset.Values = block(desc, "Values", "Values", numpy.float32, 1)
+    preset.Colors = block(desc, "Colors", "Colors", numpy.float32, 3)
+    preset.CommonSwitches = block(common, "Switches", "Common.Switches", numpy.bool_, 1)
+    preset.CommonValues = block(common, "Values", "Common.Values", numpy.int32, 1)
+    preset.CommonColors = block(common, "Colors", "Common.Colors", numpy.float32, 3)
+    preset.TextureMaps = tuple(desc.get("TextureMaps", []))
+    if not all(isinstance(t, str) for t in preset.TextureMaps):
+        raise ValueError("%s: TextureMaps must be a list of names" % path)
+    return preset
+
+# Presets are compiled on first use and kept for the session
+presets = None
+
+def LoadPresets(directory=PRESET_DIR):
+    ret = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(".json"):
+            preset = LoadPreset(os.path.join(directory, name))
+            ret[preset.Name] = preset
+    return ret
+
+def GetPreset(shaderGroup):
+    global presets
+    if presets is None:
+        presets = LoadPresets()
+    return presets.get(shaderGroup)
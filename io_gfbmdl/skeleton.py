@@ -0,0 +1,114 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Bone transforms for a whole skeleton at once. Bones are stored as local
+# translation, XYZ euler rotation (radians) and scale relative to their
+# parent, and every function here works on (N, ...) arrays.
+
+import numpy
+
+# #####################################################
+# TRS <-> matrix
+# #####################################################
+def EulerToMatrix(rot):
+    rot = numpy.asarray(rot, dtype=numpy.float64)
+    cx, cy, cz = numpy.cos(rot).T
+    sx, sy, sz = numpy.sin(rot).T
+    # Rz @ Ry @ Rx, same as Blender's 'XYZ' order
+    m = numpy.empty((len(rot), 3, 3))
+    m[:, 0, 0] = cy*cz
+    m[:, 0, 1] = sx*sy*cz - cx*sz
+    m[:, 0, 2] = cx*sy*cz + sx*sz
+    m[:, 1, 0] = cy*sz
+    m[:, 1, 1] = sx*sy*sz + cx*cz
+    m[:, 1, 2] = cx*sy*sz - sx*cz
+    m[:, 2, 0] = -sy
+    m[:, 2, 1] = sx*cy
+    m[:, 2, 2] = cx*cy
+    return m
+
+def MatrixToEuler(m):
+    x = numpy.arctan2(m[:, 2, 1], m[:, 2, 2])
+    y = numpy.arcsin(numpy.clip(-m[:, 2, 0], -1.0, 1.0))
+    z = numpy.arctan2(m[:, 1, 0], m[:, 0, 0])
+    # Gimbal lock, put all of the rotation on X
+    lock = numpy.abs(m[:, 2, 0]) > 1.0 - 1e-6
+    x[lock] = numpy.arctan2(-m[lock, 1, 2], m[lock, 1, 1])
+    z[lock] = 0.0
+    return numpy.stack((x, y, z), axis=1)
+
+def ComposeMatrices(trans, rot, scale):
+    count = len(trans)
+    m = numpy.zeros((count, 4, 4))
+    m[:, :3, :3] = EulerToMatrix(rot) * numpy.asarray(scale, dtype=numpy.float64)[:, None, :]
+    m[:, :3, 3] = trans
+    m[:, 3, 3] = 1.0
+    return m
+
+def DecomposeMatrices(m):
+    basis = m[:, :3, :3]
+    scale = numpy.linalg.norm(basis, axis=1)
+    # A mirrored basis keeps its flip on the X scale
+    flip = numpy.linalg.det(basis) < 0.0
+    scale[flip, 0] *= -1.0
+    safe = numpy.where(scale == 0.0, 1.0, scale)
+    return m[:, :3, 3].copy(), MatrixToEuler(basis / safe[:, None, :]), scale
+
+# #####################################################
+# Hierarchy
+# #####################################################
+# Parents outside the skeleton, or pointing at the bone itself, become roots
+def CleanParents(parents):
+    parents = numpy.asarray(parents, dtype=numpy.int64).copy()
+    count = len(parents)
+    parents[(parents < 0) | (parents >= count) | (parents == numpy.arange(count))] = -1
+    return parents
+
+# Depth of every bone, roots are 0. Bones caught in a cycle are made roots.
+def BoneDepths(parents):
+    count = len(parents)
+    depth = numpy.zeros(count, dtype=numpy.int64)
+    if count == 0:
+        return depth
+    hasParent = parents >= 0
+    for i in range(count):
+        newDepth = numpy.where(hasParent, depth[numpy.where(hasParent, parents, 0)] + 1, 0)
+        if numpy.array_equal(newDepth, depth):
+            return depth
+        depth = newDepth
+    cyclic = depth >= count
+    if not cyclic.any():
+        return depth
+    parents[cyclic] = -1
+    return BoneDepths(parents)
+
+def SolveWorldMatrices(local, parents):
+    parents = CleanParents(parents)
+    depth = BoneDepths(parents)
+    world = numpy.array(local, dtype=numpy.float64)
+    # Every bone of a level only needs the level above it
+    for level in range(1, depth.max() + 1 if len(depth) else 0):
+        idx = numpy.flatnonzero(depth == level)
+        world[idx] = world[parents[idx]] @ local[idx]
+    return world
+
+def SolveLocalMatrices(world, parents):
+    parents = CleanParents(parents)
+    local = numpy.array(world, dtype=numpy.float64)
+    idx = numpy.flatnonzero(parents >= 0)
+    local[idx] = numpy.linalg.inv(world[parents[idx]]) @ world[idx]
+    return local
+
+def BoneIndexMap(names):
+    return dict((name, i) for i, name in enumerate(names))
@@ -0,0 +1,137 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+MAX_INFLUENCES = 4
+
+# #####################################################
+# Vertex -> (group, weight) table
+# #####################################################
+# Influences are stored CSR style: vertex v owns the entries
+# Starts[v]:Starts[v]+Counts[v] of Groups/Weights.
+class InfluenceTable():
+    __slots__ = ['Counts', 'Starts', 'Groups', 'Weights']
+
+    def __init__(self, counts, groups, weights):
+        self.Counts = numpy.asarray(counts, dtype=numpy.int64)
+        self.Starts = numpy.zeros(len(self.Counts), dtype=numpy.int64)
+        numpy.cumsum(self.Counts[:-1], out=self.Starts[1:])
+        self.Groups = numpy.asarray(groups, dtype=numpy.int64)
+        self.Weights = numpy.asarray(weights, dtype=numpy.float32)
+
+    def __len__(self):
+        return len(self.Counts)
+
+# Blender vertices only expose their groups one by one, so gather the table
+# in a single pass over the vertices
+def GatherInfluences(vertices):
+    counts = []
+    pairs = []
+    for v in vertices:
+        groups = v.groups
+        counts.append(len(groups))
+        pairs.extend((g.group, g.weight) for g in groups)
+    if len(pairs) == 0:
+        return InfluenceTable(counts, numpy.zeros(0), numpy.zeros(0))
+    pairs = numpy.array(pairs, dtype=numpy.float64)
+    return InfluenceTable(counts, pairs[:, 0], pairs[:, 1])
+
+# Index of every vertex group in the skeleton, -1 for groups without a bone
+def MapGroupsToBones(groupNames, boneNames):
+    boneIndex = dict((name, i) for i, name in enumerate(boneNames))
+    return numpy.array([boneIndex.get(name, -1) for name in groupNames], dtype=numpy.int64)
+
+# #####################################################
+# Top influences
+# #####################################################
+# Largest-remainder rounding, so every weighted vertex sums to exactly 255
+def QuantizeWeights(weights):
+    scaled = weights * 255.0
+    q = numpy.floor(scaled).astype(numpy.int64)
+    total = numpy.where(weights.sum(axis=1) > 0.0, 255, 0)
+    missing = total - q.sum(axis=1)
+    order = numpy.argsort(q - scaled, axis=1, kind='stable')
+    bump = numpy.arange(weights.shape[1])[None, :] < missing[:, None]
+    numpy.add.at(q, (numpy.nonzero(bump)[0], order[bump]), 1)
+    return q.astype(numpy.uint8)
+
+# Bone ids are bytes, or shorts once a skeleton has more than 256 bones
+def BoneIdType(boneCnt):
+    if boneCnt > 65536:
+        raise ValueError("Too many bones for a bone id: %d" % boneCnt)
+    return numpy.uint8 if boneCnt <= 256 else numpy.uint16
+
+# Picks the strongest influences of every vertex and returns
+# (bone ids, weight bytes), both (vertCnt, maxInfluences). Bone ids are
+# uint8, or uint16 when groupBones refers to bones past 255.
+def SelectInfluences(table, groupBones, maxInfluences=MAX_INFLUENCES):
+    vertCnt = len(table)
+    boneCnt = int(groupBones.max()) + 1 if len(groupBones) else 0
+    boneIds = numpy.zeros((vertCnt, maxInfluences), dtype=BoneIdType(boneCnt))
+    weights = numpy.zeros((vertCnt, maxInfluences), dtype=numpy.float64)
+    if vertCnt == 0 or len(table.Groups) == 0:
+        return boneIds, QuantizeWeights(weights)
+
+    # Drop groups that are not bones and empty weights
+    verts = numpy.repeat(numpy.arange(vertCnt), table.Counts)
+    bones = numpy.full(len(table.Groups), -1, dtype=numpy.int64)
+    known = table.Groups < len(groupBones)
+    bones[known] = groupBones[table.Groups[known]]
+    keep = (bones >= 0) & (table.Weights > 0.0)
+    verts, bones, w = verts[keep], bones[keep], table.Weights[keep].astype(numpy.float64)
+
+    # Sort by vertex, then by descending weight, and keep the first few
+    order = numpy.lexsort((-w, verts))
+    verts, bones, w = verts[order], bones[order], w[order]
+    counts = numpy.bincount(verts, minlength=vertCnt)
+    starts = numpy.zeros(vertCnt, dtype=numpy.int64)
+    numpy.cumsum(counts[:-1], out=starts[1:])
+    slot = numpy.arange(len(verts)) - starts[verts]
+    top = slot < maxInfluences
+    boneIds[verts[top], slot[top]] = bones[top]
+    weights[verts[top], slot[top]] = w[top]
+
+    total = weights.sum(axis=1, keepdims=True)
+    numpy.divide(weights, total, out=weights, where=total > 0.0)
+    return boneIds, QuantizeWeights(weights)
+
+# #####################################################
+# Import
+# #####################################################
+# Inverse of SelectInfluences: turns per-vertex (bone id, weight) channels
+# into (bone, weight, vertex indices) runs, one per unique bone and weight
+# byte, so each run is a single vertex group assignment.
+def GroupInfluences(boneIds, weights):
+    cnt = min(boneIds.shape[1], weights.shape[1])
+    vertCnt = len(boneIds)
+    verts = numpy.repeat(numpy.arange(vertCnt, dtype=numpy.int64), cnt)
+    bones = boneIds[:, :cnt].astype(numpy.int64).ravel()
+    w = numpy.rint(numpy.clip(weights[:, :cnt], 0.0, 1.0) * 255.0).astype(numpy.int64).ravel()
+    keep = w > 0
+    verts, bones, w = verts[keep], bones[keep], w[keep]
+    if len(verts) == 0:
+        return []
+
+    # A bone listed twice on one vertex adds up
+    span = bones.max() + 1
+    keys, inverse = numpy.unique(verts * span + bones, return_inverse=True)
+    w = numpy.minimum(numpy.bincount(inverse.ravel(), weights=w).astype(numpy.int64), 255)
+    verts, bones = keys // span, keys % span
+
+    order = numpy.lexsort((verts, w, bones))
+    verts, bones, w = verts[order], bones[order], w[order]
+    splits = numpy.flatnonzero((bones[1:] != bones[:-1]) | (w[1:] != w[:-1])) + 1
+    starts = numpy.concatenate(([0], splits))
+    return [(int(bones[s]), float(w[s]) / 255.0, run) for s, run in zip(starts, numpy.split(verts, splits))]
@@ -0,0 +1,188 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Synthetic gfbmdl generator for benchmarks, no Blender needed:
+#   python synth_model.py -o corpus/ --vertices 60000 --bones 120 --materials 30 --groups 4
+#   python synth_model.py -o corpus/ --all-layouts
+# Files are written with flatbuffers.Builder through model_writer, so they
+# can check model_encoder; --direct uses the encoder instead.
+
+import os
+import sys
+import argparse
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+from Gfbmdl.VertexType import VertexType
+from Gfbmdl.BufferFormat import BufferFormat
+from vertex_buffer import EncodeVertexBuffer
+from shader_presets import ParamBlock
+import model_writer
+from model_writer import ModelDesc, MaterialDesc, MeshDesc
+from model_encoder import EncodeModel
+
+# Element count of each vertex type in the files the game ships
+ElementCounts = {
+    VertexType.Position: 3,
+    VertexType.Normal: 4,
+    VertexType.Binormal: 4,
+    VertexType.UV1: 2,
+    VertexType.UV2: 2,
+    VertexType.UV3: 2,
+    VertexType.UV4: 2,
+    VertexType.Color1: 4,
+    VertexType.Color2: 4,
+    VertexType.Color3: 4,
+    VertexType.Color4: 4,
+    VertexType.BoneID: 4,
+    VertexType.BoneWeight: 4,
+}
+
+DefaultLayout = [
+    (VertexType.Position, BufferFormat.Float, 3),
+    (VertexType.Normal, BufferFormat.HalfFloat, 4),
+    (VertexType.Binormal, BufferFormat.HalfFloat, 4),
+    (VertexType.UV1, BufferFormat.Float, 2),
+    (VertexType.Color1, BufferFormat.Byte, 4),
+    (VertexType.Color2, BufferFormat.Byte, 4),
+    (VertexType.BoneID, BufferFormat.Byte, 4),
+    (VertexType.BoneWeight, BufferFormat.BytesAsFloat, 4),
+]
+
+BufferFormats = [BufferFormat.Float, BufferFormat.HalfFloat, BufferFormat.Byte, BufferFormat.Short, BufferFormat.BytesAsFloat]
+
+# One layout per buffer format with every vertex type stored in it, which
+# covers every VertexType/BufferFormat combination across the set
+def AllLayouts():
+    layouts = []
+    for format in BufferFormats:
+        layouts.append([(vtype, format, ElementCounts[vtype]) for vtype in sorted(ElementCounts)])
+    return layouts
+
+# #####################################################
+# Random content
+# #####################################################
+def RandomAttributes(rng, layout, vertCnt, boneCnt):
+    attribs = {}
+    for vtype, format, count in layout:
+        if vtype == VertexType.BoneID:
+            attribs[vtype] = rng.integers(0, max(boneCnt, 1), size=(vertCnt, count))
+        elif vtype == VertexType.BoneWeight:
+            w = rng.random((vertCnt, count)).astype(numpy.float32)
+            attribs[vtype] = w / w.sum(axis=1, keepdims=True)
+        elif vtype in (VertexType.Normal, VertexType.Binormal):
+            n = rng.normal(size=(vertCnt, count)).astype(numpy.float32)
+            n[:, 3:] = 0.0
+            attribs[vtype] = n / numpy.linalg.norm(n, axis=1, keepdims=True)
+        elif format in (BufferFormat.Float, BufferFormat.HalfFloat) and vtype == VertexType.Position:
+            attribs[vtype] = rng.uniform(-100.0, 100.0, size=(vertCnt, count)).astype(numpy.float32)
+        elif format == BufferFormat.Short:
+            attribs[vtype] = rng.uniform(-1.0, 1.0, size=(vertCnt, count)).astype(numpy.float32)
+        else:
+            attribs[vtype] = rng.random((vertCnt, count)).astype(numpy.float32)
+    return attribs
+
+def RandomFaces(rng, vertCnt, triCnt):
+    if vertCnt < 3:
+        return numpy.zeros(0, dtype='<u2')
+    # Strip-like triangles keep neighbouring vertices together like real meshes
+    start = rng.integers(0, vertCnt - 2, size=triCnt)
+    return numpy.stack([start, start + 1, start + 2], axis=1).astype('<u2').ravel()
+
+# #####################################################
+# Model description
+# #####################################################
+def RandomMaterial(rng, index, paramCnt):
+    name = "Material%d" % index
+    mat = MaterialDesc(name, "PokeDefaultShader")
+    valueNames = ["Value%d" % i if i >= 2 else ("ColorUVScaleU", "ColorUVScaleV")[i] for i in range(paramCnt)]
+    mat.Values = ParamBlock(valueNames, rng.random(paramCnt).astype(numpy.float32), (name, "Values"))
+    mat.Switches = ParamBlock(["Switch%d" % i for i in range(paramCnt)], rng.integers(0, 2, size=paramCnt).astype(numpy.bool_), (name, "Switches"))
+    mat.Colors = ParamBlock(["Color%d" % i for i in range(paramCnt // 2)], rng.random((paramCnt // 2, 3)).astype(numpy.float32), (name, "Colors"))
+    mat.TextureMaps = tuple(("Tex%d" % i, i, (0, i % 3, 0, 0, 0, 0, 0, 0, 0.0)) for i in range(4))
+    mat.CommonValues = ParamBlock(["Common%d" % i for i in range(paramCnt // 2)], rng.integers(0, 8, size=paramCnt // 2).astype(numpy.int32), (name, "Common.Values"))
+    return mat
+
+def RandomMesh(rng, layout, vertCnt, boneCnt, groupFaces):
+    attribs = RandomAttributes(rng, layout, vertCnt, boneCnt)
+    return MeshDesc(layout, EncodeVertexBuffer(attribs, layout, vertCnt).view(numpy.uint8), groupFaces), attribs
+
+# Describes a complete model. Geometry is split evenly across `meshes`
+# meshes, each with `groups` polygon groups.
+def RandomModel(vertices=1000, layout=None, bones=16, materials=4, groups=2, meshes=1, params=16, seed=0):
+    rng = numpy.random.default_rng(seed)
+    layout = layout or DefaultLayout
+    desc = ModelDesc()
+    desc.Bounding = (-100.0, -100.0, -100.0, 100.0, 100.0, 100.0)
+    desc.TextureNames = ["Tex%d" % i for i in range(4)]
+    desc.ShaderNames = ["Material%d" % i for i in range(materials)]
+    desc.MaterialNames = ["Material%d" % i for i in range(materials)]
+    desc.Materials = [RandomMaterial(rng, i, params) for i in range(materials)]
+
+    for m in range(meshes):
+        vertCnt = min(max(vertices // meshes, 3), 65535)
+        groupFaces = []
+        for g in range(groups):
+            groupFaces.append((g % max(materials, 1), RandomFaces(rng, vertCnt, max(vertCnt // groups, 1))))
+        mesh, attribs = RandomMesh(rng, layout, vertCnt, bones, groupFaces)
+        desc.Meshes.append(mesh)
+        pos = attribs.get(VertexType.Position, numpy.zeros((1, 3)))[:, :3]
+        desc.Groups.append((m % max(bones, 1), m, pos.min(axis=0).tolist(), pos.max(axis=0).tolist()))
+
+    # Parents always come before their children
+    desc.BoneNames = ["Bone%d" % i for i in range(bones)]
+    desc.BoneTypes = numpy.ones(bones, dtype=numpy.uint32)
+    desc.BoneParents = numpy.array([-1] + [int(rng.integers(0, i)) for i in range(1, bones)], dtype=numpy.int32)[:bones]
+    desc.BoneVisible = numpy.ones(bones, dtype=numpy.bool_)
+    desc.BoneScales = numpy.ones((bones, 3), dtype=numpy.float32)
+    desc.BoneRotations = rng.uniform(-0.5, 0.5, (bones, 3)).astype(numpy.float32)
+    desc.BoneTranslations = rng.uniform(-1.0, 1.0, (bones, 3)).astype(numpy.float32)
+    return desc
+
+def BuildModel(direct=False, **kwargs):
+    desc = RandomModel(**kwargs)
+    if direct:
+        return EncodeModel(desc)
+    return model_writer.BuildModel(desc)
+
+def WriteModel(path, direct=False, **kwargs):
+    data = BuildModel(direct, **kwargs)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic gfbmdl models.")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    parser.add_argument("--vertices", type=int, default=1000)
+    parser.add_argument("--bones", type=int, default=16)
+    parser.add_argument("--materials", type=int, default=4)
+    parser.add_argument("--groups", type=int, default=2, help="polygon groups per mesh")
+    parser.add_argument("--meshes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--all-layouts", action="store_true", help="write one model per buffer format covering every vertex type")
+    parser.add_argument("--direct", action="store_true", help="encode with model_encoder instead of flatbuffers.Builder")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    params = dict(vertices=args.vertices, bones=args.bones, materials=args.materials, groups=args.groups, meshes=args.meshes, seed=args.seed, direct=args.direct)
+    if args.all_layouts:
+        for format, layout in zip(BufferFormats, AllLayouts()):
+            print(WriteModel(os.path.join(args.output, "synth_format%d.gfbmdl" % format), layout=layout, **params))
+    else:
+        print(WriteModel(os.path.join(args.output, "synth_%dv.gfbmdl" % args.vertices), **params))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
+
+from Gfbmdl.VertexType import VertexType
+from Gfbmdl.BufferFormat import BufferFormat
+
+# Storage type of a single element for each buffer format
+FormatTypes = {
+    BufferFormat.Float: '<f4',
+    BufferFormat.HalfFloat: '<f2',
+    BufferFormat.Byte: 'u1',
+    BufferFormat.Short: '<i2',
+    BufferFormat.BytesAsFloat: 'u1',
+}
+
+# Index attributes are stored unsigned and never normalized
+IndexTypes = {
+    BufferFormat.Byte: 'u1',
+    BufferFormat.Short: '<u2',
+}
+
+# Unit vectors with a sign. Byte formats store them biased, x * 0.5 + 0.5,
+# while colors, weights and UVs stay plain unorm.
+SignedTypes = (VertexType.Normal, VertexType.Binormal)
+
+VertexTypeNames = dict((v, k) for k, v in vars(VertexType).items() if not k.startswith('_'))
+
+# #####################################################
+# Layout
+# #####################################################
+def CalcStride(type, cnt):
+    if type not in FormatTypes:
+        return 0
+    return numpy.dtype(FormatTypes[type]).itemsize * cnt
+
+def ElementType(vtype, format):
+    if vtype == VertexType.BoneID and format in IndexTypes:
+        return IndexTypes[format]
+    if format not in FormatTypes:
+        raise ValueError("Unsupported buffer format %d" % format)
+    return FormatTypes[format]
+
+def FieldName(vtype):
+    return VertexTypeNames.get(vtype, "Attrib%d" % vtype)
+
+def ReadMeshLayout(mesh):
+    layout = []
+    for t in range(mesh.AttributesLength()):
+        attrib = mesh.Attributes(t)
+        layout.append((attrib.VertexType(), attrib.BufferFormat(), attrib.ElementCount()))
+    return layout
+
+def BuildVertexDtype(layout):
+    names = []
+    formats = []
+    offsets = []
+    off = 0
+    for vtype, format, count in layout:
+        name = FieldName(vtype)
+        # Repeated vertex types still need unique field names
+        while name in names:
+            name += "_"
+        names.append(name)
+        formats.append((ElementType(vtype, format), (count,)))
+        offsets.append(off)
+        off += CalcStride(format, count)
+    return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': off})
+
+# #####################################################
+# Decoding
+# #####################################################
+def ViewVertexBuffer(data, layout):
+    dtype = BuildVertexDtype(layout)
+    if dtype.itemsize == 0:
+        return numpy.zeros(0, dtype=dtype)
+    count = len(data) // dtype.itemsize
+    return numpy.frombuffer(data, dtype=dtype, count=count)
+
+def NormalizeField(values, vtype, format):
+    if vtype == VertexType.BoneID:
+        return values
+    if format == BufferFormat.Float:
+        return values
+    if format == BufferFormat.HalfFloat:
+        return values.astype(numpy.float32)
+    if format == BufferFormat.Short:
+        return numpy.maximum(values / numpy.float32(32767.0), -1.0).astype(numpy.float32)
+    if vtype in SignedTypes:
+        return values * numpy.float32(2.0 / 255.0) - numpy.float32(1.0)
+    return values * numpy.float32(1.0 / 255.0)
+
+def DecodeVertexBuffer(data, layout):
+    verts = ViewVertexBuffer(data, layout)
+    attribs = {}
+    for (vtype, format, count), name in zip(layout, verts.dtype.names):
+        if vtype in attribs:
+            continue
+        attribs[vtype] = NormalizeField(verts[name], vtype, format)
+    return attribs
+
+# #####################################################
+# Encoding
+# #####################################################
+def QuantizeField(values, vtype, format, dtype):
+    if vtype == VertexType.BoneID or format in (BufferFormat.Float, BufferFormat.HalfFloat):
+        return values.astype(dtype)
+    if format == BufferFormat.Short:
+        return numpy.rint(numpy.clip(values, -1.0, 1.0) * 32767.0).astype(dtype)
+    if vtype in SignedTypes:
+        return numpy.rint((numpy.clip(values, -1.0, 1.0) * 0.5 + 0.5) * 255.0).astype(dtype)
+    return numpy.rint(numpy.clip(values, 0.0, 1.0) * 255.0).astype(dtype)
+
+def EncodeVertexBuffer(attribs, layout, count):
+    verts = numpy.zeros(count, dtype=BuildVertexDtype(layout))
+    for (vtype, format, elems), name in zip(layout, verts.dtype.names):
+        if vtype not in attribs:
+            continue
+        values = numpy.asarray(attribs[vtype]).reshape(count, -1)
+        width = min(elems, values.shape[1])
+        field = verts[name]
+        field[:, :width] = QuantizeField(values[:, :width], vtype, format, field.dtype)
+    return verts
+
+# Merges byte-identical encoded vertices. Returns the unique vertices in
+# first-use order and, for every input vertex, its index in that list.
+def WeldVertices(verts):
+    if len(verts) == 0:
+        return verts, numpy.zeros(0, dtype=numpy.int64)
+    keys = numpy.ascontiguousarray(verts).view(numpy.dtype((numpy.void, verts.dtype.itemsize)))
+    _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    remap = numpy.empty_like(order)
+    remap[order] = numpy.arange(len(order))
+    return verts[first[order]], remap[inverse.ravel()]
+
+# #####################################################
+# Quantization error
+# #####################################################
+# Max and RMS error of storing `values` in `format`, after decoding again
+def MeasureError(values, vtype, format):
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if len(values) == 0:
+        return 0.0, 0.0
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        stored = QuantizeField(values, vtype, format, numpy.dtype(ElementType(vtype, format)))
+        err = NormalizeField(stored, vtype, format).astype(numpy.float64) - values
+    if not numpy.all(numpy.isfinite(err)):
+        return float('inf'), float('inf')
+    return float(numpy.abs(err).max()), float(numpy.sqrt(numpy.mean(err * err)))
+
+# First candidate format whose max error stays within `maxError`, the last
+# candidate otherwise. Returns (format, max error, rms error).
+def ChooseFormat(values, vtype, candidates, maxError):
+    for format in candidates:
+        maxErr, rms = MeasureError(values, vtype, format)
+        if maxErr <= maxError:
+            break
+    return format, maxErr, rms
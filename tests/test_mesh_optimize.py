@@ -0,0 +1,54 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'io_gfbmdl'))
+
+from mesh_optimize import OptimizeVertexCache, OptimizeOverdraw
+
+def GridIsland(size, base, offset):
+    faces = []
+    for y in range(size):
+        for x in range(size):
+            v = base + y * (size + 1) + x
+            faces.append((v, v + 1, v + size + 1))
+            faces.append((v + 1, v + size + 2, v + size + 1))
+    xs, ys = numpy.meshgrid(numpy.arange(size + 1), numpy.arange(size + 1))
+    pos = numpy.column_stack((xs.ravel(), ys.ravel(), numpy.zeros(xs.size))) + offset
+    return numpy.array(faces), pos
+
+def SortedRows(faces):
+    return sorted(map(tuple, numpy.asarray(faces).tolist()))
+
+def test_overdraw_with_degenerate_first_triangle():
+    faces = []
+    pos = []
+    base = 0
+    for i in range(3):
+        f, p = GridIsland(9, base, (i * 20.0, 0.0, 0.0))
+        faces.append(f)
+        pos.append(p)
+        base += len(p)
+    faces.append(numpy.array([[base, base, base + 1]]))
+    pos.append(numpy.array([[0.0, 0.0, 5.0], [1.0, 0.0, 5.0]]))
+    faces = numpy.concatenate(faces)
+    pos = numpy.concatenate(pos)
+
+    # Its two vertices have the lowest valence, so the cache order starts there
+    ordered = OptimizeVertexCache(faces)
+    assert ordered[0].tolist() == [base, base, base + 1]
+    result = OptimizeOverdraw(ordered, pos)
+    assert SortedRows(result) == SortedRows(faces)
@@ -0,0 +1,46 @@
+# Copyright (c) 2019 Reisyukaku
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import numpy
+import pytest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'io_gfbmdl'))
+
+from Gfbmdl.VertexType import VertexType
+from Gfbmdl.BufferFormat import BufferFormat
+from vertex_buffer import EncodeVertexBuffer, DecodeVertexBuffer
+
+# Half a step of each format for values in -1..1, biased bytes step 2/255
+Precision = {
+    BufferFormat.Float: 1e-6,
+    BufferFormat.HalfFloat: 1e-3,
+    BufferFormat.Byte: 1.0 / 255.0,
+    BufferFormat.Short: 1.0 / 32767.0,
+    BufferFormat.BytesAsFloat: 1.0 / 255.0,
+}
+
+@pytest.mark.parametrize("format", sorted(Precision))
+@pytest.mark.parametrize("vtype", [VertexType.Normal, VertexType.Binormal])
+def test_signed_vectors_round_trip(vtype, format):
+    rng = numpy.random.default_rng(0)
+    values = rng.normal(size=(256, 3))
+    values /= numpy.linalg.norm(values, axis=1)[:, None]
+    values = numpy.column_stack((values, numpy.ones(len(values)))).astype(numpy.float32)
+    values[:4, :3] = [[-1.0, 0.0, 0.0], [0.0, -1.0, 0.0], [0.0, 0.0, -1.0], [1.0, 1.0, 1.0]]
+
+    layout = [(vtype, format, 4)]
+    data = EncodeVertexBuffer({vtype: values}, layout, len(values)).view(numpy.uint8)
+    decoded = DecodeVertexBuffer(data, layout)[vtype].astype(numpy.float64)
+    assert numpy.abs(decoded - values).max() <= Precision[format] + 1e-6